@@ -0,0 +1,734 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright (c) 2014,
+# Karlsruhe Institute of Technology, Institute of Telematics
+#
+# This code is provided under the BSD 2-Clause License.
+# Please refer to the LICENSE.txt file for further information.
+#
+# Author: Mario Hock
+
+
+"""
+Compact archive format for CNL files (extension ".cnla"), for long-term storage.
+
+The body is split into blocks of |DEFAULT_BLOCK_ROWS| lines; each column of each block is compressed
+on its own. A footer index holds the time range of every block and the statistics of each of its columns
+(the zone map, see |cnl_library.ZoneMap|), so that a query only decodes the blocks and columns it needs
+(in parallel, see |get_num_threads|), and summaries only the blocks at the edges of a time window.
+
+Layout:
+
+    MAGIC
+    column data:  block 0 (column 0, column 1, ...), block 1 (...), ...
+    index:        zlib( length of meta (uint64) + meta (JSON) + index arrays )
+    trailer:      offset and length of the index (2x uint64) + MAGIC
+
+The meta holds the JSON header, the CSV header and everything that is needed to reproduce the original
+text byte by byte (header text, comments, lines that are not written in the usual float format, ...).
+Converting a file verifies the round-trip; files that can't be stored losslessly are refused.
+
+Column encoding (see |encode_column|): If all values of a column (in a block) have at most a few decimal places,
+they are stored as scaled integers (delta-encoded, if that makes them smaller) in the narrowest integer type,
+otherwise as plain float64. Then the column is compressed with the codec of the archive (see |CODECS|).
+
+Usage:
+    cnl_archive.py log.cnl.bz2      -->  log.cnla
+    cnl_archive.py -x log.cnla      -->  log.cnl  (exactly the original, uncompressed)
+"""
+
+
+import os
+import io
+import bz2
+import json
+import lzma
+import zlib
+import struct
+import hashlib
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+import cnl_cache
+import cnl_library
+
+
+MAGIC = cnl_library.ARCHIVE_MAGIC
+EXTENSION = cnl_library.ARCHIVE_EXTENSION
+VERSION = 1
+
+TRAILER = struct.Struct("<QQ")
+COLUMN_HEADER = struct.Struct("<bbB")      # decimal scale (-1: float64), delta-encoded, item size
+
+DEFAULT_BLOCK_ROWS = 16384
+MAX_SCALE = 9
+MAX_INT = 2**52         # (exact as float64, and deltas don't overflow)
+
+THREADS_ENV_VAR = "CNL_ARCHIVE_THREADS"
+
+## name --> ( compress, decompress )
+CODECS = { "zlib": ( lambda data: zlib.compress(data, 9), zlib.decompress ),
+           "bz2":  ( bz2.compress, bz2.decompress ),
+           "lzma": ( lzma.compress, lzma.decompress ) }
+DEFAULT_CODEC = "zlib"
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def get_num_threads():
+    if ( os.environ.get(THREADS_ENV_VAR) ):
+        return max( int(os.environ[THREADS_ENV_VAR]), 1 )
+
+    try:
+        return len( os.sched_getaffinity(0) )
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parallel_map(func, items, threads=None):
+    """
+    Like |map| (returns a list), but in a thread pool if more than one thread is to be used.
+    (zlib, bz2 and lzma release the GIL while (de)compressing.)
+    """
+    if ( threads is None ):
+        threads = get_num_threads()
+
+    items = list(items)
+    if ( threads <= 1 or len(items) <= 1 ):
+        return [ func(item) for item in items ]
+
+    with ThreadPoolExecutor( min(threads, len(items)) ) as pool:
+        return list( pool.map(func, items) )
+
+
+is_archive = cnl_library.is_archive
+
+
+def archive_name(filename):
+    """
+    "dir/log.cnl.bz2" --> "dir/log.cnla"
+    """
+    for codec in cnl_library.CODECS:
+        if ( filename.endswith(codec.extensions) ):
+            filename = os.path.splitext(filename)[0]
+            break
+
+    if ( filename.endswith(".cnl") ):
+        filename = filename[:-len(".cnl")]
+
+    return filename + EXTENSION
+
+
+def text_name(filename):
+    """
+    "dir/log.cnla" --> "dir/log.cnl"
+    """
+    if ( filename.endswith(EXTENSION) ):
+        filename = filename[:-len(EXTENSION)]
+
+    return filename + ".cnl"
+
+
+
+## Column encoding
+
+def _scaled_ints(values):
+    """
+    Returns ( integers, scale ) with |integers| / 10**|scale| == |values| (exactly, including the sign of zeros),
+    or ( None, None ) if there's no such |scale| up to |MAX_SCALE|.
+    """
+    if ( not numpy.all( numpy.isfinite(values) ) ):
+        return None, None
+
+    for scale in range( MAX_SCALE + 1 ):
+        factor = 10.0 ** scale
+        ints = numpy.rint(values * factor)
+
+        if ( len(ints) and numpy.abs(ints).max() >= MAX_INT ):
+            break
+
+        decoded = ints / factor
+        if ( numpy.array_equal(decoded, values) and numpy.array_equal( numpy.signbit(decoded), numpy.signbit(values) ) ):
+            return ints.astype(numpy.int64), scale
+
+    return None, None
+
+
+def _narrowest_int(max_abs):
+    for dtype in (numpy.int8, numpy.int16, numpy.int32):
+        if ( max_abs <= numpy.iinfo(dtype).max ):
+            return numpy.dtype(dtype)
+
+    return numpy.dtype(numpy.int64)
+
+
+def encode_column(values):
+    """
+    Returns the (uncompressed) binary representation of |values| (1-D float64 array), see module description.
+    """
+    ints, scale = _scaled_ints(values)
+
+    if ( ints is None ):
+        return COLUMN_HEADER.pack(-1, 0, 8) + values.astype("<f8").tobytes()
+
+    max_abs = int( numpy.abs(ints).max() ) if len(ints) else 0
+    deltas = numpy.diff(ints, prepend=0)
+    max_delta = int( numpy.abs(deltas).max() ) if len(deltas) else 0
+
+    delta = ( max_delta < max_abs )
+    if ( delta ):
+        ints = deltas
+        max_abs = max_delta
+
+    dtype = _narrowest_int(max_abs).newbyteorder("<")
+
+    return COLUMN_HEADER.pack(scale, delta, dtype.itemsize) + ints.astype(dtype).tobytes()
+
+
+def decode_column(data):
+    """
+    Inverse of |encode_column|.
+    """
+    scale, delta, itemsize = COLUMN_HEADER.unpack_from(data)
+
+    if ( scale < 0 ):
+        return numpy.frombuffer(data, dtype="<f8", offset=COLUMN_HEADER.size).copy()
+
+    ints = numpy.frombuffer(data, dtype="<i{}".format(itemsize), offset=COLUMN_HEADER.size).astype(numpy.int64)
+    if ( delta ):
+        ints = numpy.cumsum(ints)
+
+    return ints / 10.0 ** scale
+
+
+
+## Text format of the body lines (as written by CPUnetLOG)
+
+def format_line(row, separator):
+    return separator.join( map(repr, row) ) + "\n"
+
+
+
+## Writing
+
+def convert(filename, out_filename, codec=DEFAULT_CODEC, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Converts the CNL file |filename| (text, possibly compressed) into the archive |out_filename|
+    and verifies that the original can be reproduced exactly.
+
+    Raises ArchiveError (and removes |out_filename|) if that's not possible,
+    and CNLParser.WrongFileFormat_Exception if |filename| is not a CNL file.
+    """
+    cnl_file = cnl_library.CNLParser(filename)
+    compress = CODECS[codec][0]
+
+    meta = dict()
+    meta["version"] = VERSION
+    meta["codec"] = codec
+    meta["header"] = cnl_file.header
+    meta["csv_header"] = cnl_file.csv_header
+    meta["activity_fields"] = cnl_file.get_activity_fields()
+
+    def write(f):
+        f.write(MAGIC)
+
+        with cnl_file.open_func( filename, mode="rb" ) as in_file:
+            reader = _TextReader(in_file, cnl_file.body_offset)
+
+            meta["prefix"] = reader.prefix
+            index = _write_blocks(f, reader, len(cnl_file.csv_header), compress, block_rows, meta)
+
+            meta["suffix"] = reader.suffix
+            meta["size"] = reader.size
+            meta["sha256"] = reader.sha256.hexdigest()
+
+        _write_index(f, meta, index)
+
+    try:
+        if ( not cnl_cache.atomic_write(out_filename, write) ):
+            raise ArchiveError( "Can't write: {}".format(out_filename) )
+    except UnicodeDecodeError:
+        raise ArchiveError( "Not valid UTF-8: {}".format(filename) )
+    except ValueError as e:
+        raise ArchiveError( "{}: {}".format(filename, e) )
+
+    try:
+        verify(filename, out_filename)
+    except BaseException:
+        cnl_cache._remove_silently(out_filename)
+        raise
+
+
+class _TextReader:
+    """
+    Splits the decompressed CNL file |in_file| into header text, body lines and the rest
+    (like |cnl_library.cnl_body_lines|, but keeping everything that isn't a data line).
+    """
+
+    def __init__(self, in_file, body_offset):
+        self.in_file = in_file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+        self.prefix = self._decode( in_file.read(body_offset) )
+        self.suffix = ""
+        self.extra_lines = list()      # [ number of data lines before, text ]
+
+    def _decode(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+
+        return data.decode("UTF-8")
+
+    def data_lines(self):
+        num_lines = 0
+
+        for line in iter(self.in_file.readline, b""):
+            line = self._decode(line)
+
+            if ( line.startswith("%% End_Body") or not line.endswith("\n") ):
+                self.suffix = line + self._decode( self.in_file.read() )
+                return
+
+            if ( line[0] in "%#\r\n" ):
+                self.extra_lines.append( [num_lines, line] )
+                continue
+
+            yield line
+            num_lines += 1
+
+
+def _write_blocks(f, reader, num_cols, compress, block_rows, meta):
+    """
+    Writes the body of |reader| block by block. Returns the index arrays (see |ArchiveReader|).
+    """
+    separator = None
+    raw_lines = list()      # [ row number, text ] of lines that |format_line| doesn't reproduce
+
+    rows = list()
+    offsets = list()
+    t_min = list()
+    t_max = list()
+    stats = list()
+    idle = list()
+    trailing_idle = list()
+
+    csv_index = cnl_library.create_csv_index(meta["csv_header"])
+    lines = reader.data_lines()
+    num_rows = 0
+
+    while True:
+        block = list( islice(lines, block_rows) )
+        if ( not block ):
+            break
+
+        array = cnl_library.parse_csv_lines(block, num_cols)
+
+        ## Remember every line that isn't in the usual format.
+        if ( separator is None ):
+            separator = ", " if ", " in block[0] else ","
+        for i, (line, row) in enumerate( zip(block, array.tolist()) ):
+            if ( format_line(row, separator) != line ):
+                raw_lines.append( [num_rows + i, line] )
+
+        columns = numpy.ascontiguousarray(array.T)
+        data = parallel_map( lambda column: compress( encode_column(column) ), columns )
+
+        block_offsets = [ f.tell() ]
+        for column_data in data:
+            f.write(column_data)
+            block_offsets.append( f.tell() )
+
+        rows.append( len(array) )
+        offsets.append(block_offsets)
+        t_min.append( columns[csv_index["begin"]].min() )
+        t_max.append( columns[csv_index["end"]].max() )
+
+        ## Zone map
+        _, block_stats, block_idle, block_trailing_idle = cnl_library.ZoneMap.block_stats( array, csv_index, meta["activity_fields"] )
+        stats.append(block_stats)
+        idle.append(block_idle)
+        trailing_idle.append(block_trailing_idle)
+
+        num_rows += len(array)
+
+    meta["separator"] = separator or ", "
+    meta["raw_lines"] = raw_lines
+    meta["extra_lines"] = reader.extra_lines
+
+    return { "rows":    numpy.array(rows, dtype="<i8"),
+             "offsets": numpy.array(offsets, dtype="<i8").reshape( len(rows), num_cols + 1 ),
+             "t_min":   numpy.array(t_min, dtype="<f8"),
+             "t_max":   numpy.array(t_max, dtype="<f8"),
+             "stats":   numpy.array(stats, dtype="<f8").reshape( len(rows), len(cnl_library.ZONE_STATS), num_cols ),
+             "idle":    numpy.array(idle, dtype="<f8"),
+             "trailing_idle": numpy.array(trailing_idle, dtype="<f8") }
+
+
+## Index arrays, in the order they are stored.
+INDEX_ARRAYS = ( "rows", "offsets", "t_min", "t_max", "stats", "idle", "trailing_idle" )
+INDEX_DTYPES = { "rows": "<i8", "offsets": "<i8" }      # (others: "<f8")
+
+def _write_index(f, meta, index):
+    meta["blocks"] = len(index["rows"])
+    meta["arrays"] = INDEX_ARRAYS
+    meta["stats"] = cnl_library.ZONE_STATS
+    meta_bytes = json.dumps(meta).encode("UTF-8")
+
+    data = [ struct.pack("<Q", len(meta_bytes)), meta_bytes ]
+    data += [ numpy.ascontiguousarray( index[name], dtype=INDEX_DTYPES.get(name, "<f8") ).tobytes() for name in INDEX_ARRAYS ]
+    data = zlib.compress( b"".join(data) )
+
+    offset = f.tell()
+    f.write(data)
+    f.write( TRAILER.pack(offset, len(data)) )
+    f.write(MAGIC)
+
+
+def verify(filename, archive_filename):
+    """
+    Raises ArchiveError if |archive_filename| doesn't reproduce |filename| exactly.
+    """
+    cnl_file = cnl_library.CNLParser(filename)
+    archive = ArchiveReader(archive_filename)
+
+    with cnl_file.open_func( filename, mode="rb" ) as in_file:
+        for text in archive.iter_text():
+            data = text.encode("UTF-8")
+            if ( in_file.read( len(data) ) != data ):
+                raise ArchiveError( "Round-trip failed, not stored: {}".format(filename) )
+
+        if ( in_file.read(1) ):
+            raise ArchiveError( "Round-trip failed, not stored: {}".format(filename) )
+
+
+
+## Reading
+
+class ArchiveReader:
+    """
+    Reads a CNL archive (see module description).
+
+    The index arrays (one entry per block):
+        rows     number of lines
+        offsets  file offsets of the compressed columns (and the end of the last one)
+        t_min    minimum "begin" timestamp
+        t_max    maximum "end" timestamp
+        stats, idle, trailing_idle
+                 zone map (see |cnl_library.ZoneMap|)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as f:
+            magic = f.read( len(MAGIC) )
+
+            size = f.seek(0, io.SEEK_END)
+            if ( magic != MAGIC or size < 2 * len(MAGIC) + TRAILER.size ):
+                raise ArchiveError( "Not a CNL archive: {}".format(filename) )
+
+            f.seek( size - TRAILER.size - len(MAGIC) )
+            offset, length = TRAILER.unpack( f.read(TRAILER.size) )
+
+            if ( f.read() != MAGIC ):
+                raise ArchiveError( "Incomplete CNL archive: {}".format(filename) )
+
+            f.seek(offset)
+            try:
+                data = zlib.decompress( f.read(length) )
+            except zlib.error as e:
+                raise ArchiveError( "Corrupt CNL archive {}: {}".format(filename, e) )
+
+        meta_length, = struct.unpack_from("<Q", data)
+        self.meta = json.loads( data[8 : 8+meta_length].decode("UTF-8") )
+
+        if ( self.meta["version"] != VERSION ):
+            raise ArchiveError( "Unsupported archive version: {}".format(self.meta["version"]) )
+
+        if ( self.meta.get("arrays") != list(INDEX_ARRAYS) or "stats" not in self.meta ):
+            raise ArchiveError( "Incomplete CNL archive index: {}".format(filename) )
+
+        self.header = self.meta["header"]
+        self.csv_header = self.meta["csv_header"]
+        self.csv_index = cnl_library.create_csv_index(self.csv_header)
+        self.decompress = CODECS[ self.meta["codec"] ][1]
+
+        ## Index arrays
+        num_blocks = self.meta["blocks"]
+        num_cols = len(self.csv_header)
+        self.stat_names = self.meta["stats"]
+
+        shapes = { "offsets": (num_blocks, num_cols + 1), "stats": (num_blocks, len(self.stat_names), num_cols) }
+
+        pos = 8 + meta_length
+        for name in INDEX_ARRAYS:
+            shape = shapes.get( name, (num_blocks,) )
+            array = numpy.frombuffer( data, dtype=INDEX_DTYPES.get(name, "<f8"), count=int( numpy.prod(shape) ), offset=pos )
+            setattr( self, name, array.reshape(shape) )
+            pos += array.nbytes
+
+        self.first_rows = numpy.concatenate( ([0], numpy.cumsum(self.rows)) )
+        self.num_rows = int( self.first_rows[-1] )
+
+
+    def get_zone_map_arrays(self):
+        """
+        Returns the zone map arrays (see |cnl_cache.load_zone_map|),
+        or None if they were computed with other statistics (see |cnl_library.ZONE_STATS|).
+        """
+        if ( list(self.stat_names) != list(cnl_library.ZONE_STATS) ):
+            return None
+
+        return { "rows": self.rows, "stats": self.stats, "idle": self.idle, "trailing_idle": self.trailing_idle }
+
+
+    def select_blocks(self, t_start=None, t_end=None):
+        """
+        Returns the numbers of the blocks that may hold lines overlapping with [t_start, t_end].
+
+        Like |CNLParser._filter_time_window|, nothing behind the first line with begin > |t_end| counts;
+        so the selection ends in front of the first block that starts after |t_end|.
+        """
+        blocks = list()
+
+        for block in range( len(self.rows) ):
+            if ( t_end is not None and self.t_min[block] > t_end ):
+                break
+            if ( t_start is not None and self.t_max[block] < t_start ):
+                continue
+
+            blocks.append(block)
+
+        return blocks
+
+
+    def read_blocks(self, blocks, usecols=None):
+        """
+        Decodes the columns |usecols| (None: all) of |blocks| (in parallel, see |get_num_threads|).
+        Returns a list of 2-D float64 arrays (one per block, one row per line, one column per entry of |usecols|).
+        """
+        if ( usecols is None ):
+            usecols = range( len(self.csv_header) )
+
+        tasks = [ (block, col) for block in blocks for col in usecols ]
+
+        with open(self.filename, "rb") as f:
+            data = [ self._read_raw(f, block, col) for block, col in tasks ]
+
+        columns = parallel_map( lambda item: decode_column( self.decompress(item) ), data )
+
+        ret = list()
+        n = len(usecols)
+        for i, block in enumerate(blocks):
+            array = numpy.empty( (self.rows[block], n) )
+            for j in range(n):
+                array[:, j] = columns[i*n + j]
+            ret.append(array)
+
+        return ret
+
+    def _read_raw(self, f, block, col):
+        f.seek( self.offsets[block, col] )
+
+        return f.read( self.offsets[block, col+1] - self.offsets[block, col] )
+
+
+    def iter_blocks(self, usecols=None, t_start=None, t_end=None):
+        """
+        Yields 2-D arrays like |read_blocks|, but only the lines that overlap with [t_start, t_end]
+        (exactly as |CNLParser._filter_time_window|), a few blocks at a time.
+        """
+        if ( usecols is None ):
+            usecols = list( range( len(self.csv_header) ) )
+
+        windowed = ( t_start is not None or t_end is not None )
+        blocks = self.select_blocks(t_start, t_end)
+
+        ## Decode "begin" and "end" as well, for the exact window.
+        cols = list(usecols)
+        if ( windowed ):
+            cols += [ self.csv_index["begin"], self.csv_index["end"] ]
+
+        step = max( get_num_threads(), 1 )
+        for first in range( 0, len(blocks), step ):
+            for array in self.read_blocks( blocks[first:first+step], cols ):
+                if ( not windowed ):
+                    yield array
+                    continue
+
+                yield array[ cnl_library.time_window_mask(array[:, -2], array[:, -1], t_start, t_end), :len(usecols) ]
+
+                ## (Nothing behind the first line with begin > t_end counts.)
+                if ( t_end is not None and numpy.any(array[:, -2] > t_end) ):
+                    return
+
+
+    def read_array(self, usecols=None, t_start=None, t_end=None):
+        """
+        Returns the lines that overlap with [t_start, t_end] as one 2-D float64 array (see |iter_blocks|).
+        """
+        num_cols = len(usecols) if usecols else len(self.csv_header)
+        arrays = list( self.iter_blocks(usecols, t_start, t_end) )
+
+        if ( not arrays ):
+            return numpy.empty( (0, num_cols) )
+
+        if ( len(arrays) == 1 ):
+            return arrays[0]
+
+        return numpy.concatenate(arrays)
+
+
+    def iter_chunks(self, usecols=None, rows=65536, t_start=None, t_end=None):
+        """
+        Like |iter_blocks|, but yields arrays of exactly |rows| lines (the last one may be shorter).
+        """
+        pending = list()
+        num_pending = 0
+
+        for array in self.iter_blocks(usecols, t_start, t_end):
+            pending.append(array)
+            num_pending += len(array)
+
+            while ( num_pending >= rows ):
+                merged = numpy.concatenate(pending) if len(pending) > 1 else pending[0]
+                yield merged[:rows]
+
+                pending = [ merged[rows:] ]
+                num_pending -= rows
+
+        if ( num_pending > 0 ):
+            yield numpy.concatenate(pending) if len(pending) > 1 else pending[0]
+
+
+    def _iter_block_lines(self, blocks):
+        """
+        Yields ( row number, text ) of the data lines of |blocks|.
+        """
+        raw_lines = dict( self.meta["raw_lines"] )
+        separator = self.meta["separator"]
+        step = max( get_num_threads(), 1 )
+
+        for first in range( 0, len(blocks), step ):
+            arrays = self.read_blocks( blocks[first:first+step] )
+
+            for block, array in zip( blocks[first:first+step], arrays ):
+                row = int( self.first_rows[block] )
+
+                for values in array.tolist():
+                    line = raw_lines.get(row)
+                    yield row, line if line is not None else format_line(values, separator)
+                    row += 1
+
+
+    def iter_lines(self, t_start=None, t_end=None):
+        """
+        Yields the CSV body lines (text, like |cnl_library.cnl_body_lines|) of the blocks that may overlap
+        with [t_start, t_end] (see |select_blocks|; the lines still have to be filtered exactly).
+        """
+        for row, line in self._iter_block_lines( self.select_blocks(t_start, t_end) ):
+            yield line
+
+
+    def iter_text(self):
+        """
+        Yields the original text of the CNL file, piece by piece.
+        """
+        yield self.meta["prefix"]
+
+        extra_lines = self.meta["extra_lines"]
+        i = 0
+
+        for row, line in self._iter_block_lines( range( len(self.rows) ) ):
+            while ( i < len(extra_lines) and extra_lines[i][0] <= row ):
+                yield extra_lines[i][1]
+                i += 1
+
+            yield line
+
+        for row, line in extra_lines[i:]:
+            yield line
+
+        yield self.meta["suffix"]
+
+
+    def extract(self, out_file):
+        """
+        Writes the original CNL file to the binary file |out_file|. Raises ArchiveError if the checksum doesn't match.
+        """
+        sha256 = hashlib.sha256()
+
+        for text in self.iter_text():
+            data = text.encode("UTF-8")
+            sha256.update(data)
+            out_file.write(data)
+
+        if ( sha256.hexdigest() != self.meta["sha256"] ):
+            raise ArchiveError( "Checksum mismatch: {}".format(self.filename) )
+
+
+
+## MAIN ##
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser( description="Converts CNL files into CNL archives (.cnla) and back." )
+
+    parser.add_argument("files", nargs='+')
+    parser.add_argument("-x", "--extract", action="store_true",
+                        help="Extract the original CNL file(s) from archive(s).")
+    parser.add_argument("-o", "--output",
+                        help="Output filename (only for a single input file). Default: *.cnl <--> *.cnla")
+    parser.add_argument("-c", "--codec", choices=sorted(CODECS), default=DEFAULT_CODEC,
+                        help="Compression of the columns. (Default: {})".format(DEFAULT_CODEC))
+    parser.add_argument("-r", "--block-rows", type=int, default=DEFAULT_BLOCK_ROWS, metavar="N",
+                        help="Lines per block. (Default: {})".format(DEFAULT_BLOCK_ROWS))
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Overwrite existing output files.")
+
+    args = parser.parse_args()
+
+    if ( args.output and len(args.files) > 1 ):
+        parser.error("--output only works with a single input file")
+
+    failed = False
+
+    for filename in args.files:
+        out_filename = args.output or ( text_name(filename) if args.extract else archive_name(filename) )
+
+        if ( os.path.exists(out_filename) and not args.force ):
+            print( "[ERROR] Exists already (use -f to overwrite): {}".format(out_filename), file=sys.stderr )
+            failed = True
+            continue
+
+        try:
+            if ( args.extract ):
+                archive = ArchiveReader(filename)
+
+                def write(f):
+                    archive.extract(f)
+
+                if ( not cnl_cache.atomic_write(out_filename, write) ):
+                    raise ArchiveError( "Can't write: {}".format(out_filename) )
+            else:
+                convert(filename, out_filename, args.codec, args.block_rows)
+
+        except ArchiveError as e:
+            print( "[ERROR] {}".format(e), file=sys.stderr )
+            failed = True
+            continue
+        except cnl_library.CNLParser.WrongFileFormat_Exception:
+            print( "[ERROR] Not a CNL file: {}".format(filename), file=sys.stderr )
+            failed = True
+            continue
+
+        print( "{} --> {}".format(filename, out_filename) )
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,372 @@
+# -*- coding:utf-8 -*-
+
+# Copyright (c) 2014,
+# Karlsruhe Institute of Technology, Institute of Telematics
+#
+# This code is provided under the BSD 2-Clause License.
+# Please refer to the LICENSE.txt file for further information.
+#
+# Author: Mario Hock
+
+
+"""
+Sidecar files that are stored next to a CNL file, to speed up later reads.
+
+The sidecar of "dir/log.cnl.bz2" is "dir/.log.cnl.bz2.<suffix>" (hidden, so cnl_ls doesn't list it).
+A sidecar is only valid as long as size and mtime of the CNL file didn't change.
+
+Set the environment variable CNL_NO_CACHE (e.g. CNL_NO_CACHE=1) to neither read nor write any sidecar files.
+"""
+
+
+import os
+import json
+import struct
+import tempfile
+import numpy
+
+
+CACHE_ENV_VAR = "CNL_NO_CACHE"
+
+COLUMNS_SUFFIX = "cnlcols"
+COLUMNS_MAGIC = b"CNLCOLS\x02"
+COLUMNS_DTYPE = "<f8"
+ALIGNMENT = 64
+
+INDEX_SUFFIX = "cnlidx"
+INDEX_MAGIC = b"CNLIDX\x00\x01"
+
+ZONE_MAP_SUFFIX = "cnlzone"
+ZONE_MAP_MAGIC = b"CNLZONE\x01"
+
+
+def is_enabled():
+    return os.environ.get(CACHE_ENV_VAR, "") in ("", "0")
+
+
+def sidecar_path(filename, suffix):
+    dirname, basename = os.path.split( os.path.abspath(filename) )
+
+    return os.path.join( dirname, ".{}.{}".format(basename, suffix) )
+
+
+def source_stat(filename):
+    """
+    Returns what a sidecar of |filename| is validated against.
+    """
+    st = os.stat(filename)
+
+    return [st.st_size, st.st_mtime_ns]
+
+
+def atomic_write(path, write_func):
+    """
+    Calls |write_func| with a temporary binary file (in the directory of |path|)
+    and renames it to |path| afterwards.
+
+    Thus readers never see a half-written file, even if several processes build the same sidecar
+    concurrently. (The last rename wins, but all of them are complete and equivalent.)
+
+    Returns False if the directory is not writable.
+    """
+
+    try:
+        fd, tmp_path = tempfile.mkstemp( dir=os.path.dirname(path), prefix=os.path.basename(path), suffix=".tmp" )
+    except OSError:
+        return False
+
+    try:
+        os.chmod(tmp_path, 0o644)   # (mkstemp creates the file as private)
+
+        with os.fdopen(fd, "wb") as f:
+            write_func(f)
+        os.replace(tmp_path, path)
+    except OSError:
+        _remove_silently(tmp_path)
+        return False
+    except:
+        _remove_silently(tmp_path)
+        raise
+
+    return True
+
+
+def _remove_silently(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _write_meta(f, magic, meta):
+    """
+    Writes |magic|, the length of the JSON encoded |meta| and |meta| itself.
+    Pads to |ALIGNMENT| and returns the offset where the payload starts.
+    """
+    meta_bytes = json.dumps(meta).encode("UTF-8")
+    f.write(magic)
+    f.write( struct.pack("<Q", len(meta_bytes)) )
+    f.write(meta_bytes)
+
+    offset = len(magic) + 8 + len(meta_bytes)
+    padding = -offset % ALIGNMENT
+    f.write( b"\0" * padding )
+
+    return offset + padding
+
+
+def _read_meta(f, magic):
+    if ( f.read(len(magic)) != magic ):
+        return None, None
+
+    length, = struct.unpack( "<Q", f.read(8) )
+    meta = json.loads( f.read(length).decode("UTF-8") )
+
+    offset = len(magic) + 8 + length
+    offset += -offset % ALIGNMENT
+
+    return meta, offset
+
+
+def _read_valid_meta(filename, suffix, magic):
+    """
+    Returns (meta, payload offset, sidecar path) if there is a sidecar for |filename|
+    that matches the current state of |filename|, otherwise (None, None, path).
+    """
+    path = sidecar_path(filename, suffix)
+
+    try:
+        with open(path, "rb") as f:
+            meta, offset = _read_meta(f, magic)
+    except (OSError, ValueError, struct.error):
+        return None, None, path
+
+    if ( not meta or meta.get("source") != source_stat(filename) ):
+        return None, None, path
+
+    return meta, offset, path
+
+
+
+## Binary column cache
+
+def load_columns(filename, csv_header):
+    """
+    Memory-maps the column cache of |filename|. It holds the columns that have been needed so far (see |store_columns|).
+
+    Returns ( columns, index ): a read-only 2-D array with one row per cached field (i.e. each column is contiguous)
+    and a dict that maps the field names to these rows; or None if there is no valid cache.
+    """
+    if ( not is_enabled() ):
+        return None
+
+    meta, offset, path = _read_valid_meta(filename, COLUMNS_SUFFIX, COLUMNS_MAGIC)
+    try:
+        if ( not meta or meta["csv_header"] != csv_header or not set(meta["fields"]) <= set(csv_header) ):
+            return None
+
+        shape = ( len(meta["fields"]), meta["rows"] )
+        index = { field: i for i, field in enumerate(meta["fields"]) }
+    except (KeyError, TypeError):
+        return None
+
+    ## (numpy can't map empty files.)
+    if ( meta["rows"] == 0 or not meta["fields"] ):
+        return numpy.empty(shape), index
+
+    try:
+        return numpy.memmap(path, dtype=COLUMNS_DTYPE, mode="r", offset=offset, shape=shape), index
+    except (OSError, ValueError):
+        return None
+
+
+def store_columns(filename, csv_header, cached, fields, chunks, stat, block_rows=8192):
+    """
+    Writes the column cache of |filename|: the already |cached| columns (as returned by |load_columns|, or None)
+    plus the new |fields|, given as |chunks| of row-major 2-D arrays (one column per field in |fields|,
+    e.g. from |cnl_library.iter_csv_arrays|). In the cache, each field is one contiguous row.
+
+    The chunks are first written one after the other into a temporary file (the number of lines isn't known before),
+    which is then read back |block_rows| lines at a time and transposed into the cache.
+    Thus, never more than one chunk or block is in memory (also for files that don't fit into memory).
+
+    |stat| must be the |source_stat| of |filename| from *before* the columns were read.
+    Returns True on success.
+    """
+    if ( not is_enabled() ):
+        return False
+
+    path = sidecar_path(filename, COLUMNS_SUFFIX)
+    old_columns, old_index = cached if cached else ( numpy.empty( (0, 0) ), dict() )
+    old_fields = sorted( old_index, key=old_index.get )
+    item_size = numpy.dtype(COLUMNS_DTYPE).itemsize
+
+    try:
+        spool = tempfile.TemporaryFile( dir=os.path.dirname(path), suffix=".tmp" )
+    except OSError:
+        return False
+
+    with spool:
+        rows = 0
+        for chunk in chunks:
+            numpy.ascontiguousarray(chunk, dtype=COLUMNS_DTYPE).tofile(spool)
+            rows += len(chunk)
+
+        ## Don't store anything if the file changed meanwhile (e.g. it's still being written).
+        if ( source_stat(filename) != stat or ( old_fields and old_columns.shape[1] != rows ) ):
+            return False
+
+        meta = dict()
+        meta["source"] = stat
+        meta["csv_header"] = csv_header
+        meta["fields"] = old_fields + list(fields)
+        meta["rows"] = rows
+
+        def write(f):
+            offset = _write_meta(f, COLUMNS_MAGIC, meta)
+
+            ## The old columns, as they are.
+            for i in range( len(old_fields) ):
+                for first in range( 0, rows, block_rows ):
+                    numpy.ascontiguousarray( old_columns[i, first:first+block_rows], dtype=COLUMNS_DTYPE ).tofile(f)
+
+            ## The new ones: Each block goes to |len(fields)| places, one part of every column.
+            offset += len(old_fields) * rows * item_size
+            spool.seek(0)
+
+            for first in range( 0, rows, block_rows ):
+                block = numpy.fromfile( spool, dtype=COLUMNS_DTYPE, count=min(block_rows, rows - first) * len(fields) )
+                block = block.reshape( -1, len(fields) )
+
+                for i in range( len(fields) ):
+                    f.seek( offset + (i * rows + first) * item_size )
+                    numpy.ascontiguousarray(block[:, i]).tofile(f)
+
+        return atomic_write(path, write)
+
+
+
+## Sparse offset index
+
+def load_offset_index(filename, body_offset):
+    """
+    Returns the sparse offset index of |filename| as tuple of two arrays (begin timestamps, byte offsets),
+    or None if there is no valid index.
+
+    (See |CNLParser.get_offset_index|.)
+    """
+    if ( not is_enabled() ):
+        return None
+
+    meta, offset, path = _read_valid_meta(filename, INDEX_SUFFIX, INDEX_MAGIC)
+    if ( not meta or meta["body_offset"] != body_offset ):
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            begins = numpy.fromfile(f, dtype="<f8", count=meta["entries"])
+            offsets = numpy.fromfile(f, dtype="<i8", count=meta["entries"])
+    except (OSError, ValueError):
+        return None
+
+    if ( len(offsets) != meta["entries"] ):
+        return None
+
+    return begins, offsets
+
+
+def store_offset_index(filename, body_offset, begins, offsets, stat):
+    """
+    Writes the sparse offset index of |filename|. (|stat|: see |store_columns|.)
+    """
+    if ( not is_enabled() or source_stat(filename) != stat ):
+        return False
+
+    meta = dict()
+    meta["source"] = stat
+    meta["body_offset"] = body_offset
+    meta["entries"] = len(begins)
+
+    def write(f):
+        _write_meta(f, INDEX_MAGIC, meta)
+        numpy.asarray(begins, dtype="<f8").tofile(f)
+        numpy.asarray(offsets, dtype="<i8").tofile(f)
+
+    return atomic_write( sidecar_path(filename, INDEX_SUFFIX), write )
+
+
+
+## Zone map (block statistics)
+
+ZONE_MAP_ARRAYS = [ "rows", "stats", "idle", "trailing_idle" ]
+
+def load_zone_map(filename, csv_header, activity_fields):
+    """
+    Returns the arrays of the zone map of |filename| as dict (see |cnl_library.ZoneMap|) plus its "block_rows",
+    or None if there is no valid one.
+    """
+    if ( not is_enabled() ):
+        return None
+
+    meta, offset, path = _read_valid_meta(filename, ZONE_MAP_SUFFIX, ZONE_MAP_MAGIC)
+    if ( not meta ):
+        return None
+
+    arrays = dict()
+    try:
+        if ( meta["csv_header"] != csv_header or meta["activity_fields"] != activity_fields ):
+            return None
+
+        num_blocks = meta["blocks"]
+        block_rows = meta["block_rows"]
+        if ( not isinstance(block_rows, int) or block_rows <= 0 or sorted(meta["arrays"]) != sorted(ZONE_MAP_ARRAYS) ):
+            return None
+
+        shapes = { "rows": (num_blocks,), "stats": (num_blocks, meta["num_stats"], len(csv_header)),
+                   "idle": (num_blocks,), "trailing_idle": (num_blocks,) }
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for name in meta["arrays"]:
+                count = int( numpy.prod(shapes[name]) )
+                array = numpy.fromfile(f, dtype="<i8" if name == "rows" else "<f8", count=count)
+
+                if ( len(array) != count ):
+                    return None
+                arrays[name] = array.reshape(shapes[name])
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+
+    ## (Every block has at most |block_rows| lines.)
+    if ( numpy.any(arrays["rows"] < 0) or numpy.any(arrays["rows"] > block_rows) ):
+        return None
+
+    arrays["block_rows"] = block_rows
+
+    return arrays
+
+
+def store_zone_map(filename, csv_header, activity_fields, block_rows, arrays, stat):
+    """
+    Writes the zone map |arrays| (dict: name --> array, see |load_zone_map|) of |filename|.
+    (|stat|: see |store_columns|.)
+    """
+    if ( not is_enabled() or source_stat(filename) != stat ):
+        return False
+
+    meta = dict()
+    meta["source"] = stat
+    meta["csv_header"] = csv_header
+    meta["activity_fields"] = activity_fields
+    meta["block_rows"] = block_rows
+    meta["blocks"] = len(arrays["rows"])
+    meta["num_stats"] = arrays["stats"].shape[1]
+    meta["arrays"] = ZONE_MAP_ARRAYS
+
+    def write(f):
+        _write_meta(f, ZONE_MAP_MAGIC, meta)
+        for name in meta["arrays"]:
+            numpy.ascontiguousarray(arrays[name], dtype="<i8" if name == "rows" else "<f8").tofile(f)
+
+    return atomic_write( sidecar_path(filename, ZONE_MAP_SUFFIX), write )
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+
+# Copyright (c) 2014,
+# Karlsruhe Institute of Technology, Institute of Telematics
+#
+# This code is provided under the BSD 2-Clause License.
+# Please refer to the LICENSE.txt file for further information.
+#
+# Author: Mario Hock
+
+
+"""
+Persistent catalog of CNL files (sqlite3), so that cnl_ls doesn't have to open every file again.
+
+For each file, the catalog stores size, mtime, the JSON header (plus hostname, date, comment and NICs
+as separate columns) and -- once computed -- the summary of the LogAnalyzer.
+
+An entry is only used as long as size and mtime of the file are unchanged (see |cnl_cache.source_stat|).
+
+cnl_ls creates the catalog (DEFAULT_FILENAME, in the current directory) unless it is disabled
+(cnl_ls -nc, or the environment variable |cnl_cache.CACHE_ENV_VAR|).
+"""
+
+
+import os
+import json
+import sqlite3
+
+import cnl_cache
+from cnl_library import CNLParser
+
+
+DEFAULT_FILENAME = ".cnl_catalog.sqlite"
+
+
+class Catalog:
+
+    def __init__(self, path=DEFAULT_FILENAME):
+        self.db = sqlite3.connect(path, timeout=60)
+
+        self.db.execute( """CREATE TABLE IF NOT EXISTS files (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER,
+                                mtime_ns INTEGER,
+                                is_cnl INTEGER,
+                                header TEXT,
+                                csv_header TEXT,
+                                body_offset INTEGER,
+                                hostname TEXT,
+                                date REAL,
+                                comment TEXT,
+                                nics TEXT,
+                                summary TEXT )""" )
+
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+    def lookup(self, filename):
+        """
+        Returns ( up_to_date, cnl_file, summary ):
+
+          up_to_date: False, if |filename| isn't in the catalog or has changed. (It has to be read then.)
+          cnl_file:   CNLParser (created without reading the file), or None if it's not a CNL file.
+          summary:    See |LogAnalyzer.get_summary|; None, if not known yet.
+        """
+
+        row = self.db.execute( "SELECT size, mtime_ns, is_cnl, header, csv_header, body_offset, summary FROM files WHERE path = ?",
+                               (os.path.abspath(filename),) ).fetchone()
+
+        try:
+            if ( not row or list(row[0:2]) != cnl_cache.source_stat(filename) ):
+                return False, None, None
+        except OSError:
+            return False, None, None
+
+        size, mtime_ns, is_cnl, header, csv_header, body_offset, summary = row
+
+        if ( not is_cnl ):
+            return True, None, None
+
+        cnl_file = CNLParser.from_header( filename, json.loads(header), json.loads(csv_header), body_offset )
+
+        if ( summary ):
+            summary = json.loads(summary)
+
+        return True, cnl_file, summary
+
+
+    def store(self, filename, cnl_file, stat):
+        """
+        Stores (or replaces) the entry of |filename|. |cnl_file| is None if it's not a CNL file.
+
+        |stat| must be the |cnl_cache.source_stat| of |filename| from *before* it was read.
+        """
+
+        values = [ os.path.abspath(filename) ] + stat
+
+        if ( cnl_file ):
+            values += [ 1, json.dumps(cnl_file.get_json_header()), json.dumps(cnl_file.csv_header), cnl_file.body_offset,
+                        cnl_file.get_hostname(), cnl_file.get_machine_readable_date(), cnl_file.get_comment(),
+                        json.dumps(cnl_file.get_nics()) ]
+        else:
+            values += [ 0, None, None, None, None, None, None, None ]
+
+        self.db.execute( "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)", values )
+
+
+    def store_summary(self, filename, summary):
+        """
+        Adds the LogAnalyzer |summary| to the (already stored) entry of |filename|.
+        """
+        self.db.execute( "UPDATE files SET summary = ? WHERE path = ?",
+                         (json.dumps(summary), os.path.abspath(filename)) )
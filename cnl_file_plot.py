@@ -13,10 +13,12 @@ import matplotlib
 import matplotlib.pyplot as plt
 import os
 import copy
+import numpy
 
-from cnl_library import CNLParser, calc_ema, merge_lists, pretty_json, get_common_base_time, get_base_times
+from cnl_library import CNLParser, plateau_x_values, pretty_json, get_common_base_time, get_base_times
 import cnl_plot
 import plot_ticks
+import plot_decimate
 
 ## Workaround: "pdf-presenter-console" needs this, otherwise no text is displayed at all.
 matplotlib.rc('pdf', fonttype=42)
@@ -25,11 +27,11 @@ matplotlib.rc('pdf', fonttype=42)
 
 ## TODO the following functions should be shared among cnl_plot and this file
 
-def prepare_x_values(cnl_file, plateau=True):
+def prepare_x_values(cnl_data, plateau=True):
     if ( plateau ):
-        cnl_file.x_values = merge_lists( cnl_file.cols["begin"], cnl_file.cols["end"] )
+        cnl_data.x_values = plateau_x_values( cnl_data.cols["begin"], cnl_data.cols["end"] )
     else:
-        cnl_file.x_values = cnl_file.cols["end"]
+        cnl_data.x_values = cnl_data.cols["end"]
 
 
 def net_fields_to_plot(args):
@@ -70,7 +72,7 @@ def set_tick_labels( ax, x_minutes=True, adapt_net_yticks=True ):
 
 ## NOTE: based on corresponding function in cnl_plot
 #
-def plot_net(ax, cnl_file, args):
+def plot_net(ax, cnl_data, args):
     # parameters
     legend_outside = False   # TODO make no legend and legend outside possible
     alpha = args.opacity if args.transparent_net else 1.0
@@ -86,36 +88,38 @@ def plot_net(ax, cnl_file, args):
     if ( args.sum or args.sum_only ):
         # summarize
         sum = None
-        for col_name in cnl_file.net_col_names:
+        for col_name in cnl_data.net_col_names:
             print( col_name )
 
-            if not sum:
-                sum = cnl_file.cols[col_name]
+            if ( sum is None ):
+                sum = cnl_data.cols[col_name]
             else:
-                sum = [ x+y for x,y in zip(sum, cnl_file.cols[col_name]) ]
+                sum = sum + cnl_data.cols[col_name]
 
         # (just to be compatible with cnl_plot.plot)
         aux_col_dict = dict()
         aux_col_dict["sum"] = sum
 
         # * plot *
-        cnl_plot.plot(ax, cnl_file.x_values, aux_col_dict, ["sum"], ["Total"], alpha,
-            color=args.sum_color, ema_only=True if smooth else False, smooth=smooth)
+        cnl_plot.plot(ax, cnl_data.x_values, aux_col_dict, ["sum"], ["Total"], alpha,
+            color=args.sum_color, ema_only=True if smooth else False, smooth=smooth, decimate=args.decimate,
+            time_aware=args.time_aware_smoothing, durations=cnl_data.cols["duration"])
 
 
     ## * plot regular *
     if ( not args.sum_only ):
         # Change order of the lines that will be plotted
         if ( args.reorder_plots ):
-            cols = [ cnl_file.net_col_names[int(index)-1] for index in args.reorder_plots ]
-            col_labels = [ cnl_file.net_col_labels[int(index)-1] for index in args.reorder_plots ]
+            cols = [ cnl_data.net_col_names[int(index)-1] for index in args.reorder_plots ]
+            col_labels = [ cnl_data.net_col_labels[int(index)-1] for index in args.reorder_plots ]
         else:
-            cols = cnl_file.net_col_names
-            col_labels = cnl_file.net_col_labels
+            cols = cnl_data.net_col_names
+            col_labels = cnl_data.net_col_labels
 
         # * plot regular *
-        cnl_plot.plot(ax, cnl_file.x_values, cnl_file.cols, cols, col_labels, alpha,
-                  color=args.color, ema_only=True if smooth else False, smooth=smooth)
+        cnl_plot.plot(ax, cnl_data.x_values, cnl_data.cols, cols, col_labels, alpha,
+                  color=args.color, ema_only=True if smooth else False, smooth=smooth, decimate=args.decimate,
+                  time_aware=args.time_aware_smoothing, durations=cnl_data.cols["duration"])
 
 
 
@@ -125,7 +129,7 @@ def plot_net(ax, cnl_file, args):
             offset = matplotlib.transforms.ScaledTranslation(0, -20, matplotlib.transforms.IdentityTransform())
             trans = ax.transAxes + offset
 
-            l = ax.legend( loc='upper left', bbox_to_anchor=(0, 0), ncol=int(len(cnl_file.net_col_names)/2),
+            l = ax.legend( loc='upper left', bbox_to_anchor=(0, 0), ncol=int(len(cnl_data.net_col_names)/2),
                         bbox_transform = trans,
                         fancybox=False, shadow=False#,
                         #fontsize=layout.fontsize.legend
@@ -161,24 +165,27 @@ def plot(subplot_args, base_times=0):
         ## Plot all files (with a common base time)
         #
         for filename in args.files:
-            cnl_file = cnl_plot.parse_cnl_file(filename, nic_fields, nics)
-
             # if individual base_times are used, get the next one
             if isinstance(base_times, list):
                 current_base_time = base_times[i]
                 i += 1
 
+            # only read the samples that are visible (--x-min / --x-max)
+            t_start, t_end = cnl_plot.get_time_window(args.x_min, args.x_max, current_base_time)
+            cnl_data = cnl_plot.parse_cnl_file(filename, nic_fields, nics, t_start, t_end, top_nics=args.top_nics,
+                                               cpu_fields=[], dtype=numpy.float32 if args.float32 else numpy.float64)
+
             ## show some output
             print( filename )
-            #print( pretty_json(cnl_file.get_general_header()) )
+            #print( pretty_json(cnl_data.parser.get_general_header()) )
             #print()
 
-            prepare_x_values(cnl_file)
-            cnl_file.x_values = [ x - current_base_time for x in cnl_file.x_values ]
+            prepare_x_values(cnl_data)
+            cnl_data.x_values = cnl_data.x_values - current_base_time
 
 
             ## * Plot *
-            plot_net(ax, cnl_file, args)
+            plot_net(ax, cnl_data, args)
 
 
 
@@ -277,6 +284,8 @@ if __name__ == "__main__":
         parser.add_argument("-s", "--send-only", action="store_true")
         parser.add_argument("-r", "--receive-only", action="store_true")
         parser.add_argument("--nics", nargs='*')
+        parser.add_argument("--top-nics", type=int, metavar="K",
+                            help="Only load and plot the K busiest of the (given) NICs.")
         parser.add_argument("-nl", "--nic-labels", nargs='*')
         parser.add_argument("--reorder-plots", nargs='*')
 
@@ -304,6 +313,14 @@ if __name__ == "__main__":
         parser.add_argument("-sn", "--smooth-net", nargs='?', const=DEFAULT_ALPHA, type=float,
                             metavar="ALPHA",
                             help = "Smooth transmission rates with exponential moving average. (Disabled by default. When specified without parameter: ALPHA=0.1)" )
+        parser.add_argument("-ts", "--time-aware-smoothing", nargs='?', const=0.0, type=float,
+                            metavar="SECONDS",
+                            help = "Weight each sample by its duration when smoothing: ALPHA is the weight of a sample of SECONDS. (When specified without parameter: the median sample duration.)" )
+
+        parser.add_argument("--decimate", choices=plot_decimate.METHODS,
+                            help="Reduce every line to about the pixel width of the plot: min/max per bucket (peak-preserving) or LTTB. (Disabled by default.)")
+        parser.add_argument("-f32", "--float32", action="store_true",
+                            help="Keep the loaded samples as float32 instead of float64 (half the memory; the timestamps stay float64).")
 
         parser.add_argument("-o", "--output", default = "live",
                             help="Set output type. Choices: live, pdf, Default: live")
@@ -10,12 +10,22 @@
 # Author: Mario Hock
 
 
-from io import StringIO
+from io import StringIO, TextIOWrapper
+import io
+from itertools import islice
 
 import json
 import csv
 import os
+import bz2
+import gzip
+import lzma
+import tempfile
+import numpy
+from collections import OrderedDict
 
+import cnl_cache
+import parallel_bz2
 
 
 
@@ -24,7 +34,7 @@ def get_base_times(cnl_files):
 
     for file in cnl_files:
         if ( type(file) == str ):
-            cnl_file = CNLParser(file)
+            cnl_file = parsed_files.get_parser(file)
         else:
             cnl_file = file
 
@@ -74,6 +84,59 @@ def merge_lists(first, second):
     return [item for pair in zip(first, second) for item in pair]
 
 
+## Plateaus
+#
+#  Each sample is drawn as a plateau from its begin to its end. Usually the samples are contiguous,
+#  then x = [begin_0, begin_1, ..., begin_n-1, end_n-1] with drawstyle="steps-post" shows the same
+#  without duplicating every value (y = [v_0, ..., v_n-1, v_n-1], see |step_y_values|).
+#  Otherwise (gaps between the samples) every value is duplicated: x = [begin_0, end_0, begin_1, end_1, ...].
+
+def plateau_x_values(begin, end, tolerance=1e-6):
+    """
+    Returns the x-values to draw the samples |begin| -> |end| as plateaus (numpy array):
+    Steps (length: n+1) if the samples are contiguous (up to |tolerance| seconds), otherwise duplicated points (length: 2n).
+    """
+    begin = numpy.asarray(begin, dtype=numpy.float64)
+    end = numpy.asarray(end, dtype=numpy.float64)
+
+    if ( len(begin) == 0 ):
+        return begin
+
+    if ( numpy.all( numpy.abs(begin[1:] - end[:-1]) <= tolerance ) ):
+        return numpy.append(begin, end[-1])
+
+    return numpy.column_stack( (begin, end) ).ravel()
+
+
+def is_steps(x_values, num_samples):
+    """
+    True, if |x_values| (see |plateau_x_values|) are steps for |num_samples| samples, False for duplicated points.
+    (No samples count as steps, so that samples added later are drawn the same way.)
+    """
+    return ( num_samples == 0 or len(x_values) == num_samples + 1 )
+
+
+def step_y_values(values):
+    """
+    y-values for the steps of |plateau_x_values|. (The last value lasts until the end of the last sample.)
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    return numpy.append(values, values[-1:])
+
+
+def steps_to_plateaus(x, y):
+    """
+    Materializes steps (|plateau_x_values|, |step_y_values|) as duplicated points,
+    for output that can't draw steps by itself (e.g. a LineCollection).
+    """
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+
+    return numpy.repeat(x, 2)[1:-1], numpy.repeat(y[:-1], 2)
+
+
+
 ## Exponential moving average
 def calc_ema(values, alpha=0.2):
     ret = list()
@@ -92,6 +155,83 @@ def calc_ema(values, alpha=0.2):
     return ret
 
 
+def calc_ema_batch(columns, alpha=0.2, durations=None, ref_duration=None, block_size=128):
+    """
+    Exponential moving average of many series at once (vectorized; equal to |calc_ema| up to float rounding).
+
+    @param columns   2-D array, one series per column.
+    @param durations [None]  Every sample has the same weight (like |calc_ema|).
+                     [array] Time-aware: The weight of sample i is 1 - (1-alpha)^(durations[i] / ref_duration),
+                             i.e. |alpha| is the weight of a sample that lasted |ref_duration|
+                             (Default: median of the positive |durations|; if there are none,
+                              every sample has the same weight). Zero, negative and NaN durations: no weight.
+                             Raises ValueError if |ref_duration| is given, but not a positive finite number.
+
+    Returns a 2-D float64 array of the same shape.
+
+    ***
+
+    The recursion  ema[i] = a[i] * x[i] + (1-a[i]) * ema[i-1]  is solved block by block:
+    Within a block, each ema value is a weighted sum of the block's samples plus the decayed last ema value
+    of the previous block. These weights form a lower triangular matrix, so a whole block of all columns
+    is just one matrix multiplication. (All weights are <= 1, so this is numerically stable.)
+    """
+    columns = numpy.asarray(columns, dtype=numpy.float64)
+    n = len(columns)
+    ret = numpy.empty_like(columns)
+
+    if ( n == 0 ):
+        return ret
+
+    ## weights of the samples
+    if ( durations is None ):
+        weights = numpy.full(n, float(alpha))
+    else:
+        durations = numpy.asarray(durations, dtype=numpy.float64)
+        durations = numpy.where(durations > 0, durations, 0.0)
+
+        if ( not ref_duration ):
+            positive = durations[ (durations > 0) & numpy.isfinite(durations) ]
+            ref_duration = numpy.median(positive) if len(positive) > 0 else None
+        elif ( not ( numpy.isfinite(ref_duration) and ref_duration > 0 ) ):
+            raise ValueError( "ref_duration must be positive: {}".format(ref_duration) )
+
+        if ( ref_duration is None ):
+            weights = numpy.full(n, float(alpha))
+        else:
+            weights = 1.0 - (1.0 - alpha) ** (durations / ref_duration)
+
+    # (log of the decay; clipped, so that a weight of 1 doesn't produce log(0))
+    log_decay = numpy.log( numpy.maximum(1.0 - weights, 1e-300) )
+
+    ## init
+    ret[0] = columns[0]
+    const_matrix = None
+
+    ## blocks
+    for start in range(1, n, block_size):
+        end = min(start + block_size, n)
+        size = end - start
+
+        # cumulative decay within the block
+        cum = numpy.cumsum( log_decay[start:end] )
+
+        # (with constant weights, all full blocks have the same matrix)
+        if ( durations is None and size == block_size and const_matrix is not None ):
+            matrix = const_matrix
+        else:
+            diff = cum[:, None] - cum[None, :]
+            diff[ numpy.triu_indices(size, 1) ] = -numpy.inf
+            matrix = numpy.exp(diff) * weights[start:end][None, :]
+
+            if ( durations is None and size == block_size ):
+                const_matrix = matrix
+
+        ret[start:end] = matrix @ columns[start:end] + numpy.exp(cum)[:, None] * ret[start-1][None, :]
+
+    return ret
+
+
 
 def pretty_json(data):
     return json.dumps(data, sort_keys=True, indent=4)
@@ -106,18 +246,40 @@ def cnl_slice(file, start_delimiter, end_delimiter):
         if ( line.startswith(start_delimiter) ):
             break
 
+    yield from cnl_body_lines(file, end_delimiter)
+
+
+def cnl_body_lines(file, end_delimiter):
+    """
+    Like |cnl_slice|, but |file| is expected to be positioned already behind the start delimiter.
+    """
+
     ## Skip comments and quit on end
     for line in file:
         if ( line.startswith(end_delimiter) ):
             return
 
         # skip empty or commented lines
-        if ( not line or line[0] == "%" or line[0] == "#" ):
+        if ( not line or line[0] in "%#\r\n" ):
             continue
 
+        # incomplete last line (the file is still being written)
+        if ( not line.endswith("\n") ):
+            return
+
         yield line
 
 
+def decoded_lines(file, encoding="UTF-8"):
+    """
+    Yields the lines of the binary |file| as strings.
+
+    NOTE: Other than iterating over a text file, this keeps |file.tell()| usable.
+    """
+    for line in iter(file.readline, b""):
+        yield line.decode(encoding)
+
+
 
 def create_csv_index(csv_header):
     ## Create an index that maps csv_header names to tuple indices.
@@ -131,6 +293,462 @@ def create_csv_index(csv_header):
 
 
 
+## Number of lines that are parsed at once by |iter_csv_arrays|.
+CSV_CHUNK_LINES = 65536
+
+
+def iter_csv_arrays(lines, num_cols, usecols=None, chunk_lines=CSV_CHUNK_LINES):
+    """
+    Parses CNL body |lines| in chunks of (up to) |chunk_lines| lines;
+    yields one 2-D float64 numpy array (one row per line) for each chunk.
+
+    Each chunk is converted in bulk by numpy. Only if that fails (a malformed line somewhere in the chunk),
+    the chunk is parsed again line by line with the |csv| module (see |parse_csv_lines_slow|).
+
+    @param num_cols Number of columns of the result (needed in case a chunk is empty).
+    @param usecols  See numpy.loadtxt.
+    """
+
+    lines = iter(lines)
+
+    while True:
+        chunk = list( islice(lines, chunk_lines) )
+        if ( not chunk ):
+            return
+
+        try:
+            array = numpy.loadtxt( chunk, dtype=numpy.float64, delimiter=",",
+                                   comments=None, usecols=usecols, ndmin=2 )
+        except ValueError:
+            array = parse_csv_lines_slow(chunk, num_cols, usecols)
+
+        yield array
+
+
+def parse_csv_lines_slow(lines, num_cols, usecols=None):
+    """
+    Like |parse_csv_lines|, but line by line with the |csv| module, which is more forgiving
+    (e.g. quoted values). Raises ValueError if a line still can't be parsed.
+    """
+
+    rows = list()
+    for values in csv.reader( lines, skipinitialspace=True ):
+        if ( usecols ):
+            if ( max(usecols) >= len(values) ):
+                raise ValueError( "Malformed CSV line in CNL body (too few columns): {}".format(values) )
+
+            values = [ values[i] for i in usecols ]
+
+        elif ( len(values) != num_cols ):
+            raise ValueError( "Malformed CSV line in CNL body (wrong number of columns): {}".format(values) )
+
+        rows.append( [ float( v ) for v in values ] )
+
+    ## (An empty body does not tell numpy how many columns there are.)
+    if ( not rows ):
+        return numpy.empty( (0, num_cols) )
+
+    return numpy.array( rows, dtype=numpy.float64 )
+
+
+def parse_csv_lines(lines, num_cols, usecols=None):
+    """
+    Parses CNL body |lines| in bulk into a 2-D float64 numpy array (one row per line).
+
+    @param num_cols Number of columns of the result (needed in case |lines| is empty).
+    @param usecols  See numpy.loadtxt.
+    """
+
+    arrays = list( iter_csv_arrays(lines, num_cols, usecols) )
+
+    ## (An empty body does not tell numpy how many columns there are.)
+    if ( not arrays ):
+        return numpy.empty( (0, num_cols) )
+
+    if ( len(arrays) == 1 ):
+        return arrays[0]
+
+    return numpy.concatenate(arrays)
+
+
+
+def time_window_mask(begin, end, t_start=None, t_end=None):
+    """
+    Returns a boolean mask of the lines (arrays |begin| and |end|) that |CNLParser._filter_time_window| passes:
+    end >= t_start and begin <= t_end, but nothing behind the first line with begin > t_end.
+    """
+    mask = numpy.ones( len(begin), dtype=bool )
+
+    if ( t_start is not None ):
+        mask &= ( end >= t_start )
+
+    if ( t_end is not None ):
+        stop = numpy.flatnonzero(begin > t_end)
+        if ( len(stop) > 0 ):
+            mask[stop[0]:] = False
+
+    return mask
+
+
+
+## Zone maps
+
+## Statistics per block and field (see |ZoneMap|).
+ZONE_STATS = ("min", "max", "sum", "weighted_sum", "first_active", "last_active")
+MIN, MAX, SUM, WEIGHTED_SUM, FIRST_ACTIVE, LAST_ACTIVE = range( len(ZONE_STATS) )
+
+
+class ZoneMap:
+    """
+    Statistics of consecutive blocks of lines, so that summaries over whole blocks
+    don't have to read the lines again (see |CNLParser.get_zone_map|).
+
+    Arrays (one entry per block):
+        rows           number of lines
+        stats          [block, stat, field]  with stat (see |ZONE_STATS|):
+                         min, max, sum
+                         weighted_sum   sum of value * duration
+                         first_active   "begin" of the first line with value > 0 (NaN: there's none)
+                         last_active    "end" of the last line with value > 0
+        idle           total duration of the lines without activity (no value > 0 in any of the "activity fields")
+        trailing_idle  ... of those behind the last line with activity
+
+    The fields are the ones of |csv_index|.
+    """
+
+    def __init__(self, csv_index, rows, stats, idle, trailing_idle):
+        self.csv_index = csv_index
+        self.rows = rows
+        self.stats = stats
+        self.idle = idle
+        self.trailing_idle = trailing_idle
+
+        self.first_rows = numpy.concatenate( ([0], numpy.cumsum(rows)) ).astype(numpy.int64)
+
+
+    @classmethod
+    def compute(cls, arrays, csv_index, activity_fields):
+        """
+        Creates the zone map of |arrays| (one 2-D array per block, one column per field in |csv_index|).
+        """
+        blocks = [ cls.block_stats(array, csv_index, activity_fields) for array in arrays ]
+        num_blocks = len(blocks)
+
+        return cls( csv_index,
+                    numpy.array( [ block[0] for block in blocks ], dtype=numpy.int64 ),
+                    numpy.array( [ block[1] for block in blocks ], dtype=numpy.float64 ).reshape( num_blocks, len(ZONE_STATS), len(csv_index) ),
+                    numpy.array( [ block[2] for block in blocks ], dtype=numpy.float64 ),
+                    numpy.array( [ block[3] for block in blocks ], dtype=numpy.float64 ) )
+
+
+    @staticmethod
+    def block_stats(array, csv_index, activity_fields):
+        """
+        Returns ( rows, stats, idle, trailing_idle ) of one block (2-D array, one column per field in |csv_index|).
+        """
+        n = len(array)
+        durations = array[:, csv_index["duration"]]
+        positive = ( array > 0 )
+
+        stats = numpy.full( (len(ZONE_STATS), array.shape[1]), numpy.nan )
+        stats[MIN] = array.min(axis=0, initial=numpy.inf)
+        stats[MAX] = array.max(axis=0, initial=-numpy.inf)
+        stats[SUM] = array.sum(axis=0)
+        stats[WEIGHTED_SUM] = ( array * durations[:, None] ).sum(axis=0)
+
+        if ( n > 0 ):
+            has_active = positive.any(axis=0)
+            first = numpy.argmax(positive, axis=0)
+            last = n - 1 - numpy.argmax(positive[::-1], axis=0)
+
+            stats[FIRST_ACTIVE] = numpy.where( has_active, array[first, csv_index["begin"]], numpy.nan )
+            stats[LAST_ACTIVE] = numpy.where( has_active, array[last, csv_index["end"]], numpy.nan )
+
+        ## Activity: Any of the activity fields is > 0.
+        active = positive[:, [ csv_index[field] for field in activity_fields ]].any(axis=1)
+        active_lines = numpy.flatnonzero(active)
+        trailing = durations[ active_lines[-1] + 1 : ] if len(active_lines) > 0 else durations
+
+        return n, stats, durations[~active].sum(), trailing.sum()
+
+
+    def get_arrays(self):
+        return { "rows": self.rows, "stats": self.stats, "idle": self.idle, "trailing_idle": self.trailing_idle }
+
+
+    def select(self, t_start=None, t_end=None):
+        """
+        Yields ( block, complete ) for the blocks holding lines that overlap with [t_start, t_end]
+        (like |CNLParser._filter_time_window|); |complete| is True if that's the case for all lines of the block.
+
+        Only the lines of incomplete blocks have to be read (see |CNLParser.read_zone_block|).
+        """
+        begin_col = self.csv_index["begin"]
+        end_col = self.csv_index["end"]
+
+        for block in range( len(self.rows) ):
+            first_begin = self.stats[block, MIN, begin_col]
+            last_begin = self.stats[block, MAX, begin_col]
+            first_end = self.stats[block, MIN, end_col]
+            last_end = self.stats[block, MAX, end_col]
+
+            ## Nothing from here on (the first line already starts too late).
+            if ( t_end is not None and first_begin > t_end ):
+                return
+
+            stops = ( t_end is not None and last_begin > t_end )
+
+            if ( t_start is not None and last_end < t_start and not stops ):
+                continue
+
+            yield block, ( not stops and (t_start is None or first_end >= t_start) )
+
+            ## (Some line of this block starts too late, nothing behind it counts.)
+            if ( stops ):
+                return
+
+
+
+## Compression codecs
+
+class Codec:
+    """
+    A compression format that CNL files can be stored in.
+
+    |open_func| (filename, mode="rb") returns a buffered file object that decompresses while reading
+    (in one streaming pass; seeking forward is supported by skipping).
+    |errors| are the exceptions that are raised on data that isn't in this format.
+    |compress_func| (data) returns |data| compressed in this format (only used by |check_codecs|).
+    """
+
+    def __init__(self, name, extensions, magic, open_func, errors=(), compress_func=None):
+        self.name = name
+        self.extensions = extensions
+        self.magic = magic
+        self.open_func = open_func
+        self.errors = (EOFError, OSError) + tuple(errors)
+        self.compress_func = compress_func
+
+
+## (Like |parallel_bz2.open|: the readline() calls of the parser are served from this buffer.)
+CODEC_BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE * 16
+
+def buffered(open_func):
+    """
+    Wraps |open_func| so that the returned file object is read through an io.BufferedReader of |CODEC_BUFFER_SIZE|.
+    """
+    def open_buffered(filename, mode="rb"):
+        return io.BufferedReader( open_func(filename, mode), buffer_size=CODEC_BUFFER_SIZE )
+
+    return open_buffered
+
+
+class ForwardSeekableReader(io.RawIOBase):
+    """
+    Raw stream over a decompressing |reader| that only supports seeking forward, but says it isn't seekable
+    (e.g. zstandard's stream reader), so that io.BufferedReader can be used on top of it.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        return self.reader.readinto(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.reader.seek(offset, whence)
+
+    def tell(self):
+        return self.reader.tell()
+
+    def close(self):
+        if ( not self.closed ):
+            self.reader.close()
+        super().close()
+
+
+CODECS = list()
+
+def register_codec(codec):
+    CODECS.append(codec)
+
+
+def find_codec(filename):
+    """
+    Returns the |Codec| of |filename|: by its extension or, if the extension is unknown, by its first bytes.
+    None: uncompressed.
+    """
+    for codec in CODECS:
+        if ( filename.endswith(codec.extensions) ):
+            return codec
+
+    try:
+        with open(filename, "rb") as f:
+            head = f.read( max( len(codec.magic) for codec in CODECS ) )
+    except OSError:
+        return None
+
+    for codec in CODECS:
+        if ( head.startswith(codec.magic) ):
+            return codec
+
+    return None
+
+
+## CNL archives (see |cnl_archive|; detected here, the module itself is only imported to read an archive)
+ARCHIVE_MAGIC = b"CNLARC\x00\x01"
+ARCHIVE_EXTENSION = ".cnla"
+
+def is_archive(filename):
+    if ( filename.endswith(ARCHIVE_EXTENSION) ):
+        return True
+
+    try:
+        with open(filename, "rb") as f:
+            return f.read( len(ARCHIVE_MAGIC) ) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+register_codec( Codec("bz2", (".bz2",), b"BZh", parallel_bz2.open, compress_func=bz2.compress) )    # (multi-stream files in parallel)
+register_codec( Codec("gzip", (".gz",), b"\x1f\x8b", buffered(gzip.open), compress_func=gzip.compress) )
+register_codec( Codec("xz", (".xz", ".lzma"), b"\xfd7zXZ\x00", buffered(lzma.open), [lzma.LZMAError], lzma.compress) )
+
+## zstd: only if the module is installed.
+try:
+    import zstandard
+
+    def open_zstd(filename, mode="rb"):
+        """
+        Like |zstandard.open| (reading, binary only), but buffered and across all frames (e.g. of pzstd).
+        """
+        if ( mode not in ("r", "rb") ):
+            raise ValueError( "Invalid mode: {}".format(mode) )
+
+        reader = zstandard.ZstdDecompressor().stream_reader( open(filename, "rb"), read_across_frames=True, closefd=True )
+        return io.BufferedReader( ForwardSeekableReader(reader), buffer_size=CODEC_BUFFER_SIZE )
+
+    register_codec( Codec("zstd", (".zst", ".zstd"), b"\x28\xb5\x2f\xfd", open_zstd, [zstandard.ZstdError],
+                          zstandard.ZstdCompressor().compress) )
+except ImportError:
+    pass
+
+
+def check_codecs(filename):
+    """
+    Smoke check of the registered codecs: The (uncompressed) CNL file |filename| is compressed with each codec
+    (into a temporary directory) and must be parsed to the same header and values as the original.
+
+    Returns the names of the checked codecs; raises AssertionError on a mismatch.
+    """
+    original = CNLParser(filename)
+    expected = original.get_csv_array()[0]
+
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    checked = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for codec in CODECS:
+            if ( not codec.compress_func ):
+                continue
+
+            compressed_filename = os.path.join( tmp_dir, os.path.basename(filename) + codec.extensions[0] )
+            with open(compressed_filename, "wb") as f:
+                f.write( codec.compress_func(data) )
+
+            cnl_file = CNLParser(compressed_filename)
+            assert cnl_file.header == original.header, "{}: header differs".format(codec.name)
+            assert numpy.array_equal( cnl_file.get_csv_array()[0], expected, equal_nan=True ), \
+                   "{}: values differ".format(codec.name)
+
+            checked.append(codec.name)
+
+    return checked
+
+
+def check_projection(filename):
+    """
+    Smoke check of the column projection (see |CNLParser.get_numpy_columns|): In a copy of the CNL file |filename|
+    (in a temporary directory), the last field is replaced by garbage in every line. Reading some other fields
+    (with and without the column cache) must still give the same values as the original,
+    i.e. the unrequested field is never converted; and the column cache must not hold it.
+
+    Raises AssertionError (or ValueError, if the garbage was converted) on failure.
+    """
+    original = CNLParser(filename)
+    garbage_field = original.csv_header[-1]
+    fields = original.csv_header[:2] + original.csv_header[3:-1][:2]
+    expected = original.get_csv_array(fields)[0]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_filename = os.path.join( tmp_dir, "projection.cnl" )
+
+        with original.open_func( filename, mode="rb" ) as in_file, open(copy_filename, "wb") as out_file:
+            out_file.write( in_file.read(original.body_offset) )
+
+            for line in in_file:
+                if ( line[:1].isdigit() ):
+                    line = line.rstrip(b"\r\n").rsplit(b",", 1)[0] + b", garbage\n"
+                out_file.write(line)
+
+        for cache_enabled in (True, False):
+            cnl_file = CNLParser(copy_filename)
+            if ( cache_enabled ):
+                columns = cnl_file.get_numpy_columns(fields)
+                assert garbage_field not in cnl_cache.load_columns(copy_filename, cnl_file.csv_header)[1], \
+                       "unrequested field in the column cache"
+            else:
+                os.environ[cnl_cache.CACHE_ENV_VAR] = "1"
+                try:
+                    columns = cnl_file.get_numpy_columns(fields)
+                finally:
+                    del os.environ[cnl_cache.CACHE_ENV_VAR]
+
+            assert numpy.array_equal( numpy.column_stack( [ columns[field] for field in fields ] ), expected,
+                                      equal_nan=True ), "values differ"
+
+
+def check_ema():
+    """
+    Smoke check of |calc_ema_batch| against |calc_ema|, incl. degenerate durations (zero, negative, NaN, inf)
+    and reference durations.
+
+    Raises AssertionError on failure.
+    """
+    values = numpy.random.default_rng(0).random( (1000, 3) )
+    expected = numpy.column_stack( [ calc_ema(values[:, i], 0.3) for i in range(3) ] )
+
+    ## equal weights: without durations, with equal durations, and without any positive duration
+    for durations in ( None, numpy.full(1000, 0.5), numpy.zeros(1000), numpy.full(1000, numpy.nan) ):
+        assert numpy.allclose( calc_ema_batch(values, 0.3, durations), expected ), "differs from calc_ema"
+
+    ## zero median; zero, negative, NaN and infinite durations
+    durations = numpy.zeros(1000)
+    durations[::3] = 0.5
+    durations[1::7] = numpy.nan
+    durations[2::11] = -1.0
+    durations[5::13] = numpy.inf
+
+    emas = calc_ema_batch(values, 0.3, durations)
+    assert numpy.isfinite(emas).all(), "not finite"
+    assert numpy.allclose( emas, calc_ema_batch(values, 0.3, durations, 0.5) ), "wrong reference duration"
+
+    for ref_duration in ( -1.0, numpy.nan, numpy.inf ):
+        try:
+            calc_ema_batch(values, 0.3, durations, ref_duration)
+        except ValueError:
+            continue
+        assert False, "reference duration {} accepted".format(ref_duration)
+
+
+
 def read_header(f):
     str_io = StringIO()
 
@@ -147,79 +765,305 @@ class CNLParser:
     class WrongFileFormat_Exception(Exception):
         pass
 
+    ## Every INDEX_STRIDE-th line is an entry in the sparse offset index.
+    INDEX_STRIDE = 1024
 
-    def __init__(self, filename):
-        self.filename = filename
+    ## Lines per chunk when building the column cache (all columns of a chunk are in memory at once).
+    CACHE_CHUNK_LINES = 8192
+
+    ## Always in the column cache (needed for time windows, see |_window_slice|).
+    CACHE_TIME_FIELDS = ("begin", "end", "duration")
+
+    ## Lines per block of the zone map.
+    ZONE_MAP_ROWS = 16 * INDEX_STRIDE
+
+
+    def __init__(self, filename, preload=False):
+        """
+        Reads the JSON header and the CSV header of |filename|.
+
+        The position of the first CSV line is remembered in |self.body_offset|,
+        so that reading the body later on resumes from there.
+
+        @param preload [bool] Read the body once into memory (see |load_body|).
+        """
+        self._init_attributes(filename)
         #print (filename)
 
         if ( os.path.isdir(self.filename) ):
             raise self.WrongFileFormat_Exception()
 
-        ## automatically handle compressed files
-        if self.filename.endswith(".bz2"):
-            import bz2
-            self.open_func = bz2.open
-        else:
-            self.open_func = open
+        ## CNL archive: header and CSV header are in its index.
+        if ( self.archive ):
+            self.header = self.archive.header
+            self.csv_header = self.archive.csv_header
+            self.csv_index = create_csv_index(self.csv_header)
+            self.body_offset = 0
+            return
 
 
-        with self.open_func( self.filename, mode="tr", encoding="UTF-8" ) as in_file:
+        with self.open_func( self.filename, mode="rb" ) as in_file:
             try:
                 ## Check file format version.
-                if ( not in_file.readline() == "%% CPUnetLOGv1\n" ):
+                if ( not in_file.readline() == b"%% CPUnetLOGv1\n" ):
                     raise self.WrongFileFormat_Exception()
 
+                lines = decoded_lines(in_file)
+
                 ## Read JSON header.
-                self.header = read_header(in_file)
+                self.header = read_header(lines)
 
                 ## Read CSV "header"
-                csv_reader = csv.reader( cnl_slice(in_file, "%% Begin_Body", "%% End_Body"), skipinitialspace=True )
+                csv_reader = csv.reader( cnl_slice(lines, "%% Begin_Body", "%% End_Body"), skipinitialspace=True )
                 self.csv_header = next(csv_reader)
                 self.csv_index = create_csv_index(self.csv_header)
+
+                ## Remember where the data starts.
+                self.body_offset = in_file.tell()
             except UnicodeDecodeError:
                 raise self.WrongFileFormat_Exception()
+            except self.codec.errors if self.codec else ():
+                # (not compressed with the codec that its extension suggests)
+                raise self.WrongFileFormat_Exception()
+
+        if ( preload ):
+            self.load_body()
+
+
+    def _init_attributes(self, filename):
+        self.filename = filename
+        self.body_lines = None
+        self.column_cache = None
+        self.offset_index = None
+        self.zone_map = None
+        self.column_stats = dict()
+
+        ## automatically handle compressed files (see |find_codec|)
+        self.codec = find_codec(self.filename)
+        self.open_func = self.codec.open_func if self.codec else open
+
+        ## ... and CNL archives (see |is_archive|)
+        self.archive = None
+        if ( not self.codec and is_archive(self.filename) ):
+            import cnl_archive      # (not at the top: it imports this module itself)
+
+            try:
+                self.archive = cnl_archive.ArchiveReader(self.filename)
+            except cnl_archive.ArchiveError:
+                raise self.WrongFileFormat_Exception()
 
 
-    def get_csv_iterator(self, fields=None):
+    @classmethod
+    def from_header(cls, filename, header, csv_header, body_offset):
         """
-        Returns an iterator to get the csv-values line by line.
+        Creates a CNLParser from already known header information (e.g. stored in |cnl_catalog|)
+        without reading the file. (The body is read from |filename| as usual, later on.)
+        """
+        cnl_file = cls.__new__(cls)
+        cnl_file.__setstate__( (filename, header, csv_header, body_offset) )
 
-        @param fields [list] Only the "columns" specified in |fields| are included in the returned list (in that order).
-                      [None] All "columns" are included (order defined by |self.csv_header|.
+        return cnl_file
+
+
+    def __getstate__(self):
+        """
+        Only the header information is pickled (e.g. when passed to or from a worker process, see |cnl_ls|);
+        loaded data (body, column cache, ...) stays behind and is read again if needed (see |from_header|).
         """
+        return ( self.filename, self.header, self.csv_header, self.body_offset )
 
-        indices = None
+    def __setstate__(self, state):
+        filename, header, csv_header, body_offset = state
+        self._init_attributes(filename)
 
-        ## Only return selected columns (if the |fields| option is set).
-        if ( fields ):
-            indices = self.get_csv_indices_of(fields)
+        self.header = header
+        self.csv_header = csv_header
+        self.csv_index = create_csv_index(csv_header)
+        self.body_offset = body_offset
 
 
-        ## Read from file.
-        with self.open_func( self.filename, mode="tr", encoding="UTF-8" ) as in_file:
-            ## Find start of the CSV part.
-            csv_reader = csv.reader( cnl_slice(in_file, "%% Begin_Body", "%% End_Body"), skipinitialspace=True )
-            csv_header = next(csv_reader)
-            assert( csv_header == self.csv_header )
+    def _open_body(self, offset=None):
+        """
+        Returns a text file object, positioned at the first line after the CSV header
+        (or at |offset|, which must be the beginning of a line in the body).
+        """
+        in_file = self.open_func( self.filename, mode="rb" )
+        in_file.seek(self.body_offset if offset is None else offset)
 
-            ## TODO convert every field to float..?
+        return TextIOWrapper(in_file, encoding="UTF-8")
 
 
-            ## Yield line by line.
-            for line in csv_reader:
-                if ( not indices ):
-                    #yield line
-                    yield [ float( v ) for v in line ]
-                else:
-                    #yield [ line[ind] for ind in indices ]
-                    yield [ float( line[ind] ) for ind in indices ]
+    def _iter_body_lines(self, t_start=None, t_end=None, build_index=True):
+        ## Only the blocks that overlap with the time window.
+        if ( self.archive and self.body_lines is None ):
+            lines = self.archive.iter_lines(t_start, t_end)
+
+            if ( t_start is None and t_end is None ):
+                yield from lines
+            else:
+                yield from self._filter_time_window(lines, t_start, t_end)
+            return
+
+        ## Whole body.
+        if ( t_start is None and t_end is None ):
+            ## Serve from memory, if the body is already loaded.
+            if ( self.body_lines is not None ):
+                yield from self.body_lines
+                return
+
+            ## Read from file.
+            with self._open_body() as in_file:
+                yield from cnl_body_lines(in_file, "%% End_Body")
+
+        ## Time window.
+        else:
+            if ( self.body_lines is not None ):
+                yield from self._filter_time_window(self.body_lines, t_start, t_end)
+                return
+
+            ## Seek to the right part of the file (if there is an index).
+            with self._open_body( self._find_offset(t_start, build_index) ) as in_file:
+                yield from self._filter_time_window( cnl_body_lines(in_file, "%% End_Body"), t_start, t_end )
+
+
+    def _filter_time_window(self, lines, t_start, t_end):
+        """
+        Passes the lines that overlap with [t_start, t_end] (i.e. end >= t_start and begin <= t_end).
+        Stops as soon as begin > t_end.
+        """
+        begin_index = self.csv_index["begin"]
+        end_index = self.csv_index["end"]
+
+        for line in lines:
+            values = line.split(",")
+
+            if ( t_end is not None and float(values[begin_index]) > t_end ):
+                return
+
+            if ( t_start is not None and float(values[end_index]) < t_start ):
+                continue
+
+            yield line
+
+
+    def _find_offset(self, t, build_index=True):
+        """
+        Returns a file offset in the body, where all lines before have begin < |t|.
+        (Without offset index: The beginning of the body. A missing index is built, unless |build_index| is False.)
+        """
+        if ( t is None or not cnl_cache.is_enabled() ):
+            return self.body_offset
+
+        index = self.get_offset_index(build_index)
+        if ( index is None ):
+            return self.body_offset
+
+        begins, offsets = index
+        i = numpy.searchsorted(begins, t, side="left") - 1
+
+        if ( i < 0 ):
+            return self.body_offset
 
+        return int( offsets[i] )
+
+
+    def get_offset_index(self, build=True):
+        """
+        Returns a sparse index over the CSV body: Two arrays holding the "begin" timestamp and
+        the file offset of every |INDEX_STRIDE|-th line.
+
+        The index is built once and stored as sidecar (see |cnl_cache|).
+        Returns None if there's no valid one and |build| is False.
+        """
+
+        if ( self.offset_index is None ):
+            index = cnl_cache.load_offset_index(self.filename, self.body_offset)
+
+            if ( index is None ):
+                if ( not build ):
+                    return None
+
+                stat = cnl_cache.source_stat(self.filename)
+                index = self._build_offset_index()
+                cnl_cache.store_offset_index(self.filename, self.body_offset, index[0], index[1], stat)
+
+            self.offset_index = index
+
+        return self.offset_index
+
+
+    def _build_offset_index(self):
+        begin_index = self.csv_index["begin"]
+        begins = list()
+        offsets = list()
+
+        with self.open_func( self.filename, mode="rb" ) as in_file:
+            in_file.seek(self.body_offset)
+            offset = self.body_offset
+            i = 0
+
+            for line in iter(in_file.readline, b""):
+                if ( line.startswith(b"%% End_Body") ):
+                    break
+
+                # skip empty or commented lines
+                if ( line[0] not in b"%#\r\n" ):
+                    if ( i % self.INDEX_STRIDE == 0 ):
+                        begins.append( float( line.split(b",", begin_index+1)[begin_index] ) )
+                        offsets.append( offset )
+                    i += 1
+
+                offset += len(line)
+
+        return numpy.array(begins, dtype=numpy.float64), numpy.array(offsets, dtype=numpy.int64)
+
+
+    def load_body(self):
+        """
+        Reads the CSV body once and keeps it in memory.
+
+        Subsequent calls of |get_csv_iterator| and |get_csv_columns| don't touch the file any more.
+        """
+        if ( self.body_lines is None ):
+            self.body_lines = list( self._iter_body_lines() )
+
+    def unload_body(self):
+        self.body_lines = None
+
+
+    def get_csv_iterator(self, fields=None, t_start=None, t_end=None):
+        """
+        Returns an iterator to get the csv-values line by line.
+
+        @param fields [list] Only the "columns" specified in |fields| are included in the returned list (in that order).
+                      [None] All "columns" are included (order defined by |self.csv_header|.
 
-    def get_csv_columns(self, fields=None):
+        @param t_start, t_end [float] Only lines that overlap with this time window (timestamps, like "begin" and "end")
+                                      are returned. Reading starts near |t_start| (see |get_offset_index|)
+                                      and stops after |t_end|.
+        """
+
+        ## Read from memory or file (starting right behind the CSV header).
+        lines = self._iter_body_lines(t_start, t_end)
+
+        if ( fields ):
+            usecols = self.get_csv_indices_of(fields)
+            num_cols = len(fields)
+        else:
+            usecols = None
+            num_cols = len(self.csv_header)
+
+        ## Parse in bulk (chunk by chunk), but yield line by line.
+        for array in iter_csv_arrays(lines, num_cols, usecols):
+            yield from array.tolist()
+
+
+    def get_csv_columns(self, fields=None, t_start=None, t_end=None):
         """
         Returns a dictionary holding the CSV values grouped into columns.
 
         Dict-keys correspond to |self.csv_header|, if |fields| is set only the specified columns are included.
+        (For |t_start| and |t_end| see |get_csv_iterator|.)
         """
 
         ## TODO should we really use "get_..." for an I/O and computation intensive function..?
@@ -235,10 +1079,13 @@ class CNLParser:
         ## Create a list for each column.
         cols = [ list() for i in range(num_cols) ]
 
-        ## Read all csv lines and put the values in the corresponding columns,
-        for line in self.get_csv_iterator(fields):
+        ## Read all csv lines (in bulk, chunk by chunk) and put the values in the corresponding columns,
+        usecols = self.get_csv_indices_of(fields) if fields else None
+        lines = self._iter_body_lines(t_start, t_end)
+
+        for array in iter_csv_arrays(lines, num_cols, usecols):
             for i in range(num_cols):
-                cols[i].append( line[i] )
+                cols[i].extend( array[:, i].tolist() )
 
 
         ## Create output dictionary.
@@ -249,6 +1096,287 @@ class CNLParser:
         return ret
 
 
+    def get_csv_array(self, fields=None, t_start=None, t_end=None):
+        """
+        Returns the CSV values as 2-D float64 numpy array (one row per line, one column per field)
+        together with an index that maps the field names to the column numbers of that array.
+
+        The body is parsed in bulk by numpy, instead of line by line.
+        If the column cache is enabled (see |cnl_cache|), the array is memory-mapped from there.
+
+        @param fields [list] Only the "columns" specified in |fields| are included (in that order).
+                      [None] All "columns" are included (order defined by |self.csv_header|).
+
+        @param t_start, t_end  See |get_csv_iterator|.
+        """
+
+        windowed = ( t_start is not None or t_end is not None )
+
+        if ( fields ):
+            usecols = self.get_csv_indices_of(fields)
+            index = create_csv_index(fields)
+        else:
+            usecols = None
+            index = self.csv_index
+
+        ## Use the column cache (one row per field there, so transpose).
+        #    NOTE: A time window alone doesn't build the cache, the offset index is cheaper for that.
+        cached = self.get_column_cache( fields, build=not windowed )
+        if ( cached is not None ):
+            columns, cache_index = cached
+            if ( windowed ):
+                columns = columns[:, self._window_slice(cached, t_start, t_end)]
+
+            rows = [ cache_index[field] for field in (fields if fields else self.csv_header) ]
+            if ( rows != list( range( len(cache_index) ) ) ):
+                columns = columns[rows]
+
+            return columns.T, index
+
+        return self._parse_csv_array(usecols, t_start, t_end), index
+
+
+    def _window_slice(self, cached, t_start, t_end):
+        """
+        Returns the slice of the column cache (|cached|, see |get_column_cache|) that overlaps with [t_start, t_end].
+        """
+        columns, index = cached
+        first = 0
+        last = columns.shape[1]
+
+        if ( t_start is not None ):
+            first = numpy.searchsorted( columns[index["end"]], t_start, side="left" )
+        if ( t_end is not None ):
+            last = numpy.searchsorted( columns[index["begin"]], t_end, side="right" )
+
+        return slice( first, max(first, last) )
+
+
+    def _parse_csv_array(self, usecols=None, t_start=None, t_end=None):
+        ## Decode only the needed blocks and columns.
+        if ( self.archive ):
+            return self.archive.read_array(usecols, t_start, t_end)
+
+        num_cols = len(usecols) if usecols else len(self.csv_header)
+
+        return parse_csv_lines( self._iter_body_lines(t_start, t_end), num_cols, usecols )
+
+
+    def get_column_cache(self, fields=None, build=True):
+        """
+        Returns ( columns, index ): a 2-D array with one (contiguous) row per cached field
+        and a dict that maps the field names to these rows. It holds at least |fields| (None: all fields).
+
+        The columns are memory-mapped from the sidecar column cache. Fields that are not there yet
+        are parsed (only these, in one pass; plus the time fields) and added to the sidecar, unless |build| is False.
+        Thus, the cache grows with the fields that are actually used.
+
+        Returns None if the cache is disabled (see |cnl_cache|), the fields are not there (and |build| is False)
+        or can't be written (then, the callers parse the body themselves).
+        (CNL archives don't need a cache, they are columnar already.)
+        """
+
+        if ( not cnl_cache.is_enabled() or self.archive ):
+            return None
+
+        fields = fields if fields else self.csv_header
+
+        if ( self.column_cache is None ):
+            self.column_cache = cnl_cache.load_columns(self.filename, self.csv_header)
+
+        cached_fields = self.column_cache[1] if self.column_cache else dict()
+        missing = [ field for field in dict.fromkeys( list(fields) + list(self.CACHE_TIME_FIELDS) )
+                    if field not in cached_fields ]
+
+        if ( missing ):
+            if ( not build ):
+                return None
+
+            ## Build (or extend) the cache chunk by chunk (the body is never in memory, see |cnl_cache.store_columns|).
+            stat = cnl_cache.source_stat(self.filename)
+            chunks = iter_csv_arrays( self._iter_body_lines(), len(missing), self.get_csv_indices_of(missing),
+                                      chunk_lines=self.CACHE_CHUNK_LINES )
+
+            if ( not cnl_cache.store_columns(self.filename, self.csv_header, self.column_cache, missing, chunks, stat) ):
+                return None
+
+            self.column_cache = cnl_cache.load_columns(self.filename, self.csv_header)
+            if ( self.column_cache is None ):
+                return None
+
+        return self.column_cache
+
+
+    def get_numpy_columns(self, fields=None, t_start=None, t_end=None):
+        """
+        Like |get_csv_columns|, but the columns are numpy arrays
+        (views into the array returned by |get_csv_array|; memory-mapped if the column cache is used).
+        """
+
+        windowed = ( t_start is not None or t_end is not None )
+        cached = self.get_column_cache( fields, build=not windowed )
+
+        ## Direct views into the column cache.
+        if ( cached is not None ):
+            columns, cache_index = cached
+            if ( windowed ):
+                columns = columns[:, self._window_slice(cached, t_start, t_end)]
+
+            field_names = fields if fields else self.csv_header
+            return { name: columns[cache_index[name]] for name in field_names }
+
+        array, index = self.get_csv_array(fields, t_start, t_end)
+
+        return { name: array[:, i] for name, i in index.items() }
+
+
+    def iter_chunks(self, fields=None, rows=65536, t_start=None, t_end=None):
+        """
+        Yields the CSV values as 2-D float64 numpy arrays of |rows| lines each (the last one may be shorter),
+        one column per field (like |get_csv_array|).
+
+        Other than |get_csv_array|, never more than one chunk is in memory at once; thus, also files that
+        don't fit into memory can be processed. (An existing column cache or offset index is used, but none is built.)
+
+        @param fields, t_start, t_end  See |get_csv_array|.
+        """
+
+        usecols = self.get_csv_indices_of(fields) if fields else None
+        num_cols = len(fields) if fields else len(self.csv_header)
+
+        ## Slices of the memory-mapped column cache.
+        cached = self.get_column_cache(fields, build=False)
+        if ( cached is not None ):
+            columns, cache_index = cached
+            if ( t_start is not None or t_end is not None ):
+                columns = columns[:, self._window_slice(cached, t_start, t_end)]
+            cache_rows = [ cache_index[field] for field in (fields if fields else self.csv_header) ]
+
+            for first in range( 0, columns.shape[1], rows ):
+                yield numpy.column_stack( [ columns[i, first:first+rows] for i in cache_rows ] )
+
+            return
+
+        ## Decode the archive block by block.
+        if ( self.archive ):
+            yield from self.archive.iter_chunks(usecols, rows, t_start, t_end)
+            return
+
+        ## Parse the body chunk by chunk.
+        lines = self._iter_body_lines(t_start, t_end, build_index=False)
+        yield from iter_csv_arrays(lines, num_cols, usecols, chunk_lines=rows)
+
+
+    def get_column_stats(self, fields, columns=None):
+        """
+        Returns statistics of the given "columns" over the whole file:
+            { field: {"mean": <mean, weighted by the duration of the samples>, "max": <maximum>} }
+
+        Only the missing |fields| are computed, the results are kept.
+        They are computed from |columns| (dict: field --> array over the whole file, incl. "duration"),
+        if given; otherwise the file is read (in one pass, chunk by chunk; see |iter_chunks|).
+        """
+
+        missing = [ field for field in fields if field not in self.column_stats ]
+
+        if ( missing ):
+            num_rows = 0
+            total_duration = 0.0
+            weighted_sums = numpy.zeros( len(missing) )
+            sums = numpy.zeros( len(missing) )
+            max_values = numpy.full( len(missing), -numpy.inf )
+
+            if ( columns is None ):
+                chunks = self.iter_chunks( ["duration"] + missing )
+            else:
+                chunks = ( numpy.column_stack( [ columns[field][first:first+CSV_CHUNK_LINES] for field in ["duration"] + missing ] )
+                           for first in range( 0, len(columns["duration"]), CSV_CHUNK_LINES ) )
+
+            for chunk in chunks:
+                durations = chunk[:, 0]
+                values = chunk[:, 1:]
+
+                num_rows += len(chunk)
+                total_duration += durations.sum()
+                weighted_sums += ( values * durations[:, None] ).sum(axis=0)
+                sums += values.sum(axis=0)
+                max_values = numpy.maximum( max_values, values.max(axis=0, initial=-numpy.inf) )
+
+            for i, field in enumerate(missing):
+                if ( num_rows == 0 ):
+                    mean = max_value = 0.0
+                else:
+                    mean = weighted_sums[i] / total_duration if total_duration > 0 else sums[i] / num_rows
+                    max_value = max_values[i]
+
+                self.column_stats[field] = { "mean": float(mean), "max": float(max_value) }
+
+        return { field: self.column_stats[field] for field in fields }
+
+
+    def get_zone_map(self, build=False):
+        """
+        Returns the |ZoneMap| of the whole body (activity fields: see |get_activity_fields|).
+
+        CNL archives have it in their index. For other files, it's stored as sidecar (see |cnl_cache|);
+        if there's no valid one, it's computed (in one pass, see |iter_chunks|) and stored, if |build| is True.
+
+        Returns None if the cache is disabled (and the file is not an archive) or if there's no zone map
+        and |build| is False.
+        """
+
+        if ( self.zone_map is None ):
+            activity_fields = self.get_activity_fields()
+            arrays = self.archive.get_zone_map_arrays() if self.archive else None
+
+            if ( arrays is None ):
+                if ( not cnl_cache.is_enabled() ):
+                    return None
+
+                arrays = cnl_cache.load_zone_map(self.filename, self.csv_header, activity_fields)
+
+            if ( arrays is None ):
+                if ( not build ):
+                    return None
+
+                stat = cnl_cache.source_stat(self.filename)
+                zone_map = ZoneMap.compute( self.iter_chunks(rows=self.ZONE_MAP_ROWS), self.csv_index, activity_fields )
+                cnl_cache.store_zone_map(self.filename, self.csv_header, activity_fields, self.ZONE_MAP_ROWS,
+                                         zone_map.get_arrays(), stat)
+            else:
+                zone_map = ZoneMap( self.csv_index, arrays["rows"], arrays["stats"], arrays["idle"], arrays["trailing_idle"] )
+
+            self.zone_map = zone_map
+
+        return self.zone_map
+
+
+    def read_zone_block(self, zone_map, block, fields, t_start=None, t_end=None):
+        """
+        Returns the lines of |block| of |zone_map| that overlap with [t_start, t_end]
+        as 2-D array (one column per field in |fields|).
+
+        Text files are read from the nearest entry of the offset index (see |get_offset_index|),
+        CNL archives decode just this block.
+        """
+        usecols = self.get_csv_indices_of(fields) + [ self.csv_index["begin"], self.csv_index["end"] ]
+        first = int( zone_map.first_rows[block] )
+        rows = int( zone_map.rows[block] )
+
+        if ( self.archive ):
+            array = self.archive.read_blocks( [block], usecols )[0]
+        else:
+            begins, offsets = self.get_offset_index()
+            entry = first // self.INDEX_STRIDE
+            skip = first - entry * self.INDEX_STRIDE
+
+            with self._open_body( int( offsets[entry] ) ) as in_file:
+                lines = islice( cnl_body_lines(in_file, "%% End_Body"), skip, skip + rows )
+                array = parse_csv_lines( lines, len(usecols), usecols )
+
+        return array[ time_window_mask(array[:, -2], array[:, -1], t_start, t_end), :-2 ]
+
+
     ## Convenience functions ##
 
     def get_json_header(self):
@@ -284,6 +1412,12 @@ class CNLParser:
     def get_nics(self):
         return self.header["ClassDefinitions"]["NIC"]["Siblings"]
 
+    def get_activity_fields(self):
+        """
+        The fields that tell whether something is going on: send and receive of all NICs (see |LogAnalyzer|).
+        """
+        return [ nic + field for nic in self.get_nics() for field in (".send", ".receive") ]
+
     def get_sysinfo(self):
         return self.header["General"]["SystemInfo"]
 
@@ -303,12 +1437,206 @@ class CNLParser:
         return self.header["General"]["Date"][1]
 
 
+
+class CNLFollower:
+    """
+    Incrementally reads the body of a CNL file that is still being written.
+
+    Every call of |read_new_array| returns only the lines that have been appended since the last call.
+    (The first call returns everything that is already there.)
+    Incomplete lines (not yet terminated by a newline) are left for the next call.
+
+    NOTE: Only uncompressed files can be followed (no CNL archives either), see |can_follow|.
+    """
+
+    @staticmethod
+    def can_follow(filename):
+        """
+        False if |filename| is compressed (see |find_codec|) or a CNL archive.
+        """
+        return not ( find_codec(filename) or is_archive(filename) )
+
+    def __init__(self, cnl_file, fields=None):
+        if ( cnl_file.codec or cnl_file.archive ):
+            raise ValueError( "Can't follow compressed file: {}".format(cnl_file.filename) )
+
+        self.cnl_file = cnl_file
+        self.fields = fields if fields else cnl_file.csv_header
+        self.usecols = cnl_file.get_csv_indices_of(self.fields)
+
+        self.offset = cnl_file.body_offset
+        self.finished = False     # "%% End_Body" reached
+
+
+    def read_new_array(self):
+        """
+        Returns the newly appended lines as 2-D array (one column per field in |self.fields|).
+        """
+        lines = list()
+
+        if ( not self.finished ):
+            with open( self.cnl_file.filename, mode="rb" ) as in_file:
+                in_file.seek(self.offset)
+                data = in_file.read()
+
+            ## Only complete lines.
+            end = data.rfind(b"\n") + 1
+            self.offset += end
+
+            for line in data[:end].decode("UTF-8").splitlines(True):
+                if ( line.startswith("%% End_Body") ):
+                    self.finished = True
+                    break
+
+                # skip empty or commented lines
+                if ( line[0] in "%#\r\n" ):
+                    continue
+
+                lines.append(line)
+
+        return parse_csv_lines( lines, len(self.fields), self.usecols )
+
+
+    def read_new_columns(self):
+        """
+        Like |read_new_array|, but returns a dict of columns (see |CNLParser.get_numpy_columns|).
+        """
+        array = self.read_new_array()
+
+        return { name: array[:, i] for i, name in enumerate(self.fields) }
+
+
+
+class ParsedFileCache:
+    """
+    Process-wide LRU cache of parsed CNL files: the CNLParser (i.e. the header) and the columns that
+    have been loaded so far, so that a file that is used several times (base time, subplots, reference files)
+    is only opened and parsed once.
+
+    Entries are keyed by path, size and mtime (see |cnl_cache.source_stat|), a changed file is read again.
+    When the loaded columns exceed |max_bytes|, the least recently used files are evicted.
+
+    The memory budget is |DEFAULT_MAX_MB| MB, unless set by the environment variable CNL_CACHE_MB
+    (CNL_CACHE_MB=0 disables caching of columns; the headers are still cached).
+    """
+
+    MAX_MB_ENV_VAR = "CNL_CACHE_MB"
+    DEFAULT_MAX_MB = 1024
+
+    def __init__(self, max_bytes=None, max_files=256):
+        if ( max_bytes is None ):
+            max_bytes = float( os.environ.get(self.MAX_MB_ENV_VAR, self.DEFAULT_MAX_MB) ) * 2**20
+
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.num_bytes = 0
+
+        ## abspath --> [stat, CNLParser, { (t_start, t_end): {field: column} }, bytes]   (in LRU order)
+        self.entries = OrderedDict()
+
+
+    def _get_entry(self, filename):
+        path = os.path.abspath(filename)
+        stat = cnl_cache.source_stat(filename)
+
+        entry = self.entries.get(path)
+        if ( entry and entry[0] == stat ):
+            self.entries.move_to_end(path)
+            return entry
+
+        ## Not there (or outdated).
+        if ( entry ):
+            self._evict(path)
+
+        entry = [ stat, None, dict(), 0 ]
+        self.entries[path] = entry
+
+        while ( len(self.entries) > self.max_files ):
+            self._evict( next(iter(self.entries)) )
+
+        return entry
+
+    def _evict(self, path):
+        entry = self.entries.pop(path)
+        self.num_bytes -= entry[3]
+
+
+    def get_parser(self, filename):
+        """
+        Returns the CNLParser of |filename| (only created, if not cached).
+        """
+        entry = self._get_entry(filename)
+
+        if ( entry[1] is None ):
+            entry[1] = CNLParser(filename)
+
+        return entry[1]
+
+
+    def get_numpy_columns(self, cnl_file, fields, t_start=None, t_end=None):
+        """
+        Like |CNLParser.get_numpy_columns| (but |fields| is required); only the missing |fields| are read.
+
+        The returned columns are contiguous and read-only (they are shared).
+        """
+        entry = self._get_entry(cnl_file.filename)
+        if ( entry[1] is None ):
+            entry[1] = cnl_file
+
+        columns = entry[2].setdefault( (t_start, t_end), dict() )
+        missing = [ field for field in fields if field not in columns ]
+
+        if ( missing ):
+            for name, values in cnl_file.get_numpy_columns(missing, t_start, t_end).items():
+                values = numpy.ascontiguousarray(values)
+                values.flags.writeable = False
+
+                columns[name] = values
+                entry[3] += values.nbytes
+                self.num_bytes += values.nbytes
+
+            ## Evict least recently used files (but never the current one).
+            while ( self.num_bytes > self.max_bytes and next(iter(self.entries)) != os.path.abspath(cnl_file.filename) ):
+                self._evict( next(iter(self.entries)) )
+
+            ## Over budget on its own: Don't keep the columns.
+            if ( self.num_bytes > self.max_bytes ):
+                ret = { field: columns[field] for field in fields }
+
+                self.num_bytes -= entry[3]
+                entry[3] = 0
+                entry[2].clear()
+
+                return ret
+
+        return { field: columns[field] for field in fields }
+
+
+    def clear(self):
+        self.entries.clear()
+        self.num_bytes = 0
+
+
+## Shared by all users in this process.
+parsed_files = ParsedFileCache()
+
+
+
 ## MAIN ##
 if __name__ == "__main__":
 
     ### DEMO:
     import sys
 
+    ## Smoke checks (see |check_codecs|, |check_projection|, |check_ema|), on an uncompressed CNL file.
+    if ( sys.argv[1] == "--self-check" ):
+        print( "Codecs OK: " + ", ".join( check_codecs(sys.argv[2]) ) )
+        check_projection(sys.argv[2])
+        print( "Column projection OK" )
+        check_ema()
+        print( "EMA OK" )
+        sys.exit(0)
+
     filename = sys.argv[1]
     print( filename )
 
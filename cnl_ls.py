@@ -11,12 +11,21 @@
 
 
 import os
+import sqlite3
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
+import cnl_cache
+import cnl_catalog
 from cnl_library import CNLParser
 from summary import LogAnalyzer, show_match
 
 
+## LogAnalyzers of all files (filename --> LogAnalyzer), see |analyze_files|.
+log_analyzers = dict()
+
+
 def list_files_in_cur_dir():
     raw_list = os.listdir()
     no_invisible = filter(lambda filename: not filename.startswith("."), raw_list)
@@ -24,6 +33,103 @@ def list_files_in_cur_dir():
     return sorted( no_invisible )
 
 
+def parse_file(filename):
+    """
+    Returns a CNLParser for |filename|, or None if it's not a CNL file.
+    (Executed in a worker process, if -j is given; only the header information is passed back, see |CNLParser.__getstate__|.)
+    """
+    try:
+        return CNLParser(filename)
+    except CNLParser.WrongFileFormat_Exception:
+        return None
+
+
+def parallel_map(func, iterable, pool, chunksize=1):
+    """
+    Like map (the order is preserved), but executed in |pool| (if it's not None).
+    """
+    if ( not pool ):
+        return map(func, iterable)
+
+    return pool.map(func, iterable, chunksize=chunksize)
+
+
+def load_files(filenames, pool=None, catalog=None, summaries=True):
+    """
+    Returns a list with a CNLParser (or None, if it's not a CNL file) for each of |filenames|.
+
+    Files that are up to date in |catalog| are not read at all, the others are (re-)added to the catalog.
+    Known summaries are taken over into |log_analyzers| (unless |summaries| is False).
+    """
+    cnl_files = [None] * len(filenames)
+    to_parse = list()
+
+    for i, filename in enumerate(filenames):
+        if ( catalog ):
+            up_to_date, cnl_file, summary = catalog.lookup(filename)
+
+            if ( up_to_date ):
+                cnl_files[i] = cnl_file
+                if ( summary and summaries ):
+                    log_analyzers[filename] = LogAnalyzer(cnl_file, summary)
+                continue
+
+        to_parse.append(i)
+
+
+    ## Parse the remaining files (in parallel, if there's a pool).
+    if ( catalog ):
+        stats = [ cnl_cache.source_stat(filenames[i]) for i in to_parse ]
+
+    parsed = parallel_map( parse_file, [ filenames[i] for i in to_parse ], pool, chunksize=16 )
+    for n, (i, cnl_file) in enumerate( zip(to_parse, parsed) ):
+        cnl_files[i] = cnl_file
+
+        if ( catalog ):
+            catalog.store(filenames[i], cnl_file, stats[n])
+
+    return cnl_files
+
+
+def analyze_file(cnl_file, x_min=None, x_max=None, zone_map=False):
+    """
+    Returns the summary (see |LogAnalyzer.get_summary|) of |cnl_file|, for the time window [x_min, x_max]
+    (seconds relative to the start of the file; None: unlimited).
+    With |zone_map|, a missing zone map is built for the time window (see |LogAnalyzer|).
+    (Executed in a worker process, if -j is given; thus only the summary is returned, not the LogAnalyzer.)
+    """
+    base_time = cnl_file.get_machine_readable_date()
+    t_start = None if x_min is None else base_time + x_min
+    t_end = None if x_max is None else base_time + x_max
+
+    return LogAnalyzer(cnl_file, t_start=t_start, t_end=t_end, build_zone_map=zone_map).get_summary()
+
+
+def analyze_files(cnl_files, pool=None, catalog=None, x_min=None, x_max=None, zone_map=False):
+    """
+    Creates the LogAnalyzers for all |cnl_files| (possibly in parallel) and stores them in |log_analyzers|.
+    Summaries that are already known (see |load_files|) are not computed again.
+
+    Only whole-file summaries are stored in the |catalog|, not those of a time window (|x_min|, |x_max|).
+    """
+    missing = [ f for f in cnl_files if f.filename not in log_analyzers ]
+    windowed = ( x_min is not None or x_max is not None )
+
+    summaries = parallel_map( partial(analyze_file, x_min=x_min, x_max=x_max, zone_map=zone_map), missing, pool )
+    for cnl_file, summary in zip(missing, summaries):
+        log_analyzers[cnl_file.filename] = LogAnalyzer(cnl_file, summary)
+
+        if ( catalog and not windowed ):
+            catalog.store_summary(cnl_file.filename, summary)
+
+
+def get_log_analyzer(cnl_file):
+    try:
+        return log_analyzers[cnl_file.filename]
+    except KeyError:
+        return LogAnalyzer(cnl_file)
+
+
 def get_begin(cnl_file):
     return cnl_file.get_general_header()["Date"][1]
 
@@ -85,13 +191,13 @@ def print_line(left_file, right_file, long):
 def show_summary(left_file, right_file=None):
     ## BRANCH: No match -> fallback to show_brief()
     if ( not right_file ):
-        log = LogAnalyzer(left_file)
+        log = get_log_analyzer(left_file)
         log.visualize_brief(args.environment)
 
     ## BRANCH: Match -> Display both next to each other.
     else:
-        log_left = LogAnalyzer(left_file)
-        log_right = LogAnalyzer(right_file)
+        log_left = get_log_analyzer(left_file)
+        log_right = get_log_analyzer(right_file)
 
         show_match(log_left, log_right, args.environment)
 
@@ -106,7 +212,7 @@ def show(left_file, right_file, long=False, summary=False):
 
 ## MAIN ##
 if __name__ == "__main__":
-    #import sys
+    import sys
 
     ## Command line arguments
     import argparse
@@ -118,6 +224,18 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--summary", action="store_true")
     parser.add_argument("-e", "--environment", action='append', metavar="ENV",
                         help="Environment variable that should be displayed. (May be set multiple times.)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="Parse the files (and create the summaries) in N parallel processes. (0: one per CPU; Default: 1)")
+    parser.add_argument("--catalog", default=cnl_catalog.DEFAULT_FILENAME,
+                        help="Catalog of already read headers and summaries (sqlite3). It is created if it doesn't exist; use -nc to avoid that. (Default: {} in the current directory)".format(cnl_catalog.DEFAULT_FILENAME))
+    parser.add_argument("--x-min", type=float,
+                        help="Summarize only from this time on (in seconds from the start of each file).")
+    parser.add_argument("--x-max", type=float,
+                        help="Summarize only up to this time (in seconds from the start of each file).")
+    parser.add_argument("-z", "--zone-map", action="store_true",
+                        help="Build a zone map (per-block statistics, stored next to each file), so that time windows (--x-min, --x-max) are summarized without reading the whole file. (The sums may differ in the last digits.)")
+    parser.add_argument("-nc", "--no-catalog", action="store_true",
+                        help="Neither use nor update the catalog. (Also disabled by the environment variable {}.)".format(cnl_cache.CACHE_ENV_VAR))
 
     args = parser.parse_args()
 
@@ -130,13 +248,28 @@ if __name__ == "__main__":
 
 
 
+    ## Process pool (-j)
+    pool = None
+    if ( args.jobs != 1 ):
+        pool = ProcessPoolExecutor( args.jobs if args.jobs > 0 else None )
+
+
+    ## Catalog
+    catalog = None
+    if ( not args.no_catalog and cnl_cache.is_enabled() ):
+        try:
+            catalog = cnl_catalog.Catalog(args.catalog)
+        except sqlite3.Error:
+            print( "[WARNING] Can't open catalog: {}".format(args.catalog), file=sys.stderr )
+
+
     cnl_files = defaultdict(deque)
 
     ## Parse files and store them in a dict (of lists) according to their hostname.
-    for filename in filenames:
-        try:
-            cnl_file = CNLParser(filename)
-        except CNLParser.WrongFileFormat_Exception:
+    windowed = ( args.x_min is not None or args.x_max is not None )
+
+    for filename, cnl_file in zip( filenames, load_files(filenames, pool, catalog, summaries=not windowed) ):
+        if ( not cnl_file ):
             print( "Skipping: {}".format(filename) )
             continue
 
@@ -146,6 +279,16 @@ if __name__ == "__main__":
 
     hostnames = sorted( cnl_files.keys() )
 
+    ## Create all summaries at once (in parallel, if -j is given).
+    if ( args.summary ):
+        analyze_files( [ f for h in hostnames for f in cnl_files[h] ], pool, catalog, args.x_min, args.x_max, args.zone_map )
+
+    if ( pool ):
+        pool.shutdown()
+
+    if ( catalog ):
+        catalog.close()
+
     ## BRANCH: Input from two hosts -> Matching.
     if ( len(hostnames) == 2 ):
         left_files = cnl_files[hostnames[0]]
@@ -11,15 +11,19 @@
 
 
 import sys
+import numpy
 import matplotlib
+import matplotlib.collections
+import matplotlib.lines
 
 #matplotlib.use('QT4Agg')  # override matplotlibrc (optional)
 import matplotlib.pyplot as plt
 
-from cnl_library import CNLParser, calc_ema, merge_lists, pretty_json, get_common_base_time
-from plot_cpu import plot_top_cpus
+from cnl_library import CNLParser, CNLFollower, parsed_files, calc_ema_batch, plateau_x_values, is_steps, step_y_values, steps_to_plateaus, pretty_json, get_common_base_time
+from plot_cpu import plot_top_cpus, plot_cpu_heatmap, get_top_cpus_fields
 import plot_ticks
 import plot_layout
+import plot_decimate
 
 
 def append_twice(base_list, extend_list):
@@ -45,19 +49,140 @@ def append_twice(base_list, extend_list):
 
 
 
-def parse_cnl_file(filename, nic_fields = ["send", "receive"], nics=None):
+def select_busiest(cnl_file, names, fields, k, columns=None):
     """
+    Returns the |k| of |names| (CPUs or NICs) with the highest mean (see |CNLParser.get_column_stats|)
+    of their |fields| (summed up; ties: the highest maximum), in their original order.
+
+    |columns|: The columns of the whole file, if they are loaded already (otherwise, they are read).
+    """
+    stats = cnl_file.get_column_stats( [ name + "." + field for name in names for field in fields ], columns )
+
+    def load(name):
+        return ( sum( stats[name + "." + field]["mean"] for field in fields ),
+                 sum( stats[name + "." + field]["max"] for field in fields ) )
+
+    busiest = set( sorted(names, key=load, reverse=True)[:k] )
+
+    return [ name for name in names if name in busiest ]
+
+
+class CNLData:
+    """
+    The samples of a CNL file that are loaded for plotting (see |parse_cnl_file|),
+    together with the names and labels of the plotted columns.
+
+    |cols| maps the field names to contiguous 1-D numpy arrays. The data columns share one 2-D buffer
+    of type |dtype| (float32 halves the memory); the time fields (begin, end, duration) are always float64,
+    as float32 is not precise enough for timestamps.
+    (Columns that are already contiguous and of the right type, e.g. memory-mapped from the column cache, are not copied.)
+
+    The header information is available through |parser| (the CNLParser).
+    """
+
+    __slots__ = ( "parser", "cols", "net_col_names", "net_col_labels", "cpu_col_names", "cpu_col_labels",
+                  "x_values", "follower" )
+
+    TIME_FIELDS = ("begin", "end", "duration")
+
+    def __init__(self, parser, cols, dtype=numpy.float64):
+        self.parser = parser
+        self.cols = self._compact(cols, dtype)
+
+        self.net_col_names = list()
+        self.net_col_labels = list()
+        self.cpu_col_names = list()
+        self.cpu_col_labels = list()
+
+        self.x_values = None    # (see |plateau_x_values|, relative to the base time)
+        self.follower = None    # (CNLFollower, with --follow)
+
+
+    @classmethod
+    def _compact(cls, cols, dtype):
+        dtype = numpy.dtype(dtype)
+        data_fields = [ name for name in cols if name not in cls.TIME_FIELDS ]
+        ret = dict()
+
+        ## Data fields: Keep them, if they are already contiguous and of the right type,
+        #    otherwise copy them into one buffer (one row per field).
+        if ( not all( cols[name].dtype == dtype and cols[name].flags.c_contiguous for name in data_fields ) ):
+            num_samples = len( cols[data_fields[0]] )
+            buffer = numpy.empty( (len(data_fields), num_samples), dtype=dtype )
+
+            for i, name in enumerate(data_fields):
+                buffer[i] = cols[name]
+                ret[name] = buffer[i]
+
+        ## Time fields: float64.
+        for name, values in cols.items():
+            if ( name in cls.TIME_FIELDS ):
+                ret[name] = numpy.ascontiguousarray(values, dtype=numpy.float64)
+            elif ( name not in ret ):
+                ret[name] = values
+
+        ## (same order as |cols|)
+        return { name: ret[name] for name in cols }
+
+
+
+def parse_cnl_file(filename, nic_fields = ["send", "receive"], nics=None, t_start=None, t_end=None, follow=False,
+                   top_cpus=None, top_nics=None, cpu_fields=None, all_cpu_fields=None, dtype=numpy.float64):
+    """
+        Returns a |CNLData| object with the loaded samples.
+
+        filename: Either a filename or an already opened CNLParser
+                  (e.g. one with a preloaded body, that is used by a LogAnalyzer, too)
+
         nics == None: Plot all nics and name them automatically
         nics == Dict( nic-name --> nic-label )
+
+        t_start, t_end: Only load samples within this time window (absolute timestamps, None: unlimited)
+
+        follow: Read the samples through a CNLFollower (attached as |CNLData.follower|),
+                that can be used to get the samples that are appended later on.
+                (|t_start| and |t_end| are ignored in this case.)
+
+        top_cpus, top_nics: Only the |top_cpus| / |top_nics| busiest CPUs / NICs (see |select_busiest|).
+
+        cpu_fields: The fields (e.g. "util", "usr", ...) that are needed of each CPU (None: all).
+
+        all_cpu_fields: Fields that are needed of all CPUs, even those that are not among the |top_cpus|
+                        (e.g. to rank all CPUs, see |plot_cpu.plot_top_cpus|).
+
+        dtype: Storage type of the values (e.g. numpy.float32 to save memory; see |CNLData|).
+
+        Only the columns that are needed are loaded (begin, end, duration, the NIC columns and the CPU fields).
+        Header and columns are shared with other calls for the same file (see |cnl_library.ParsedFileCache|).
     """
 
     ## * Parse input file. *
-    cnl_file = CNLParser(filename)
+    if ( isinstance(filename, CNLParser) ):
+        cnl_file = filename
+    else:
+        cnl_file = parsed_files.get_parser(filename)
+
+    if ( cpu_fields is None ):
+        cpu_fields = cnl_file.get_json_header()["ClassDefinitions"]["CPU"]["Fields"]
+
+    ## --top-cpus / --top-nics: The columns of all candidates are loaded at once (one pass over the file),
+    #    the ranking is computed from them (see |select_busiest|); the plotted columns are then a subset.
+    candidate_nics = [ nic for nic in cnl_file.get_nics() if not nics or nic in nics ]
+    candidates = None
+    if ( (top_cpus or top_nics) and not follow ):
+        candidate_fields = ["begin", "end", "duration"] + \
+                           [ nic + "." + field for nic in candidate_nics for field in nic_fields ] + \
+                           [ cpu + "." + field for cpu in cnl_file.get_cpus() for field in cpu_fields + (all_cpu_fields or []) ]
+        candidates = parsed_files.get_numpy_columns( cnl_file, list( dict.fromkeys(candidate_fields) ) )
 
     ## Prepare data for matplotlib
 
     all_nics = cnl_file.get_nics()
     #nics = ("eth1", "eth2")  ## XXX
+
+    if ( top_nics ):
+        all_nics = select_busiest( cnl_file, candidate_nics, nic_fields, top_nics, candidates )
+
     net_cols = list()
     net_labels = list()
     for nic_name in all_nics:
@@ -78,68 +203,190 @@ def parse_cnl_file(filename, nic_fields = ["send", "receive"], nics=None):
         except (KeyError):
             pass
 
-    cpu_cols = [ cpu_name + ".util" for cpu_name in cnl_file.get_cpus() ]
-    cpu_col_labels = [ cpu_name for cpu_name in cnl_file.get_cpus() ]
+    cpus = cnl_file.get_cpus()
+    if ( top_cpus ):
+        cpus = select_busiest( cnl_file, cpus, ["util"], top_cpus, candidates )
+
+    cpu_cols = [ cpu_name + ".util" for cpu_name in cpus ]
+    cpu_col_labels = [ cpu_name for cpu_name in cpus ]
+
+    ## Only load the columns that are needed.
+    fields = ["begin", "end", "duration"] + net_cols + \
+             [ cpu_name + "." + cpu_field for cpu_name in cpus for cpu_field in cpu_fields ]
+    if ( all_cpu_fields ):
+        fields += [ cpu_name + "." + cpu_field for cpu_name in cnl_file.get_cpus() for cpu_field in all_cpu_fields ]
+    fields = list( dict.fromkeys(fields) )     # (unique, but in order)
 
-    cols = cnl_file.get_csv_columns()
-    #x_values = cols["end"]
+    follower = None
+    if ( follow ):
+        follower = CNLFollower(cnl_file, fields)
+        cols = follower.read_new_columns()
+    else:
+        cols = parsed_files.get_numpy_columns(cnl_file, fields, t_start, t_end)
     #print( cols )   ## XXX
 
 
-    ## Augment cnl_file with processed data.
-    cnl_file.cols = cols
-    cnl_file.net_col_names = net_cols
-    cnl_file.net_col_labels = net_labels
-    cnl_file.cpu_col_names = cpu_cols
-    cnl_file.cpu_col_labels = cpu_col_labels
-    #cnl_file.x_values = x_values
+    cnl_data = CNLData(cnl_file, cols, dtype)
+    cnl_data.net_col_names = net_cols
+    cnl_data.net_col_labels = net_labels
+    cnl_data.cpu_col_names = cpu_cols
+    cnl_data.cpu_col_labels = cpu_col_labels
+    cnl_data.follower = follower
+
+    return cnl_data
+
+
+def get_min_max_x(cnl_data):
+    return ( cnl_data.cols["begin"][0], cnl_data.cols["end"][-1] )
 
-    #cnl_file.get_cpu_label = get_cpu_label
 
+def get_time_window(x_min, x_max, base_time):
+    """
+    Converts x-axis limits (relative to |base_time|, None: unlimited) into absolute timestamps,
+    suitable for |parse_cnl_file|.
+    """
+    t_start = None if x_min is None else base_time + x_min
+    t_end = None if x_max is None else base_time + x_max
 
-    return cnl_file
+    return t_start, t_end
 
 
-def get_min_max_x(cnl_file):
-    return ( cnl_file.cols["begin"][0], cnl_file.cols["end"][-1] )
 
 
 
+def step_ema_alpha(alpha):
+    """
+    With duplicated points (see |plateau_x_values|), every sample was smoothed twice.
+    Smoothing each sample once with this alpha gives the same values at the ends of the samples.
+    """
+    return 1 - (1 - alpha) ** 2
 
 
 def plot(ax, x_values, cols, active_cols, col_labels, alpha, color=None, **kwargs):
     """
+      [x_values] see |plateau_x_values|: steps (one more than values), duplicated points (twice as many) or as is.
+
       [color] should be either None or a list,
       if there are more lines to plot then colors in the list, the list is cycled-through (with modulo)
+
+      [decimate] (kwarg) Reduce each line to about the pixel width of |ax| before plotting (see |plot_decimate.METHODS|).
+
+      [collection] (kwarg) Draw all lines as one LineCollection (the legend is built from proxy artists,
+                           see |get_legend_handles|). Scales better with many lines.
+
+      [time_aware] (kwarg) Smooth time-aware (see |calc_ema_batch|), with the reference duration given in seconds
+                           (0: the median sample duration). Needs [durations] (kwarg), the duration of each sample.
+
+      Returns a list of ( col_name, line, ema-alpha, y-values ) for every plotted line
+      (ema-alpha is None for raw values; y-values are the full, not decimated values).
     """
     
     #use_ema = kwargs.get("use_ema")
     ema_only = kwargs.get("ema_only")
     smooth = kwargs.get("smooth")
+    decimate = kwargs.get("decimate")
+    time_aware = kwargs.get("time_aware")
+    collection = kwargs.get("collection")
+    num_points = 2 * plot_decimate.get_pixel_width(ax)
 
     plot_kws = dict()
+    lines = list()
     i=0
 
+    num_samples = len(cols[active_cols[0]]) if active_cols else 0
+    steps = is_steps(x_values, num_samples)
+    doubled = ( not steps and len(x_values) == num_samples * 2 )
+
+    if ( collection ):
+        segments = list()
+        default_colors = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+
+    ## smooth all lines at once
+    if ( ema_only and smooth and active_cols ):
+        data = numpy.column_stack( [cols[col_name] for col_name in active_cols] )
+        ema_durations = None
+        ref_duration = None
+
+        if ( time_aware is not None ):
+            ema_durations = numpy.asarray( kwargs["durations"], dtype=numpy.float64 )
+            ref_duration = time_aware
+            if ( not ref_duration and len(ema_durations) > 0 ):
+                ref_duration = numpy.median(ema_durations)
+
+        if ( steps ):
+            # The smoothed values at the sample borders, connected by straight lines (no steps).
+            emas = calc_ema_batch(data, step_ema_alpha(smooth), ema_durations, ref_duration)
+            emas = numpy.concatenate( (data[:1], emas) )
+
+        else:
+            if ( doubled ):
+                data = numpy.repeat(data, 2, axis=0)
+
+                # (each half of a sample lasts half of its duration)
+                if ( ema_durations is not None ):
+                    ema_durations = numpy.repeat(ema_durations / 2, 2)
+                    ref_duration /= 2
+
+            emas = calc_ema_batch(data, smooth, ema_durations, ref_duration)
+
     for col_name, col_label in zip(active_cols, col_labels):
         if ( color ):
             plot_kws["color"] = color[i % len(color)]
 
 
-        data = cols[col_name]
-        if ( len(x_values) == len(data)*2 ):
-            data = merge_lists( data, data )
-
         # * plot *
         if ( not ema_only ):
-            ax.plot(x_values , data, label=col_label, alpha=alpha, **plot_kws)
+            data = cols[col_name]
+            if ( steps ):
+                data = step_y_values(data)
+            elif ( doubled ):
+                data = numpy.repeat(data, 2)
+
+            if ( collection ):
+                line = CollectionLine( segments, plot_kws.get("color", default_colors[i % len(default_colors)]),
+                                       col_label, alpha, steps )
+                line.set_data( *plot_decimate.decimate(x_values, data, decimate, num_points) )
+            else:
+                line, = ax.plot( *plot_decimate.decimate(x_values, data, decimate, num_points),
+                                 label=col_label, alpha=alpha, drawstyle="steps-post" if steps else "default",
+                                 **plot_kws )
+            lines.append( (col_name, line, None, data) )
 
         ## plot ema
         if ( ema_only and smooth ):
-            ax.plot(x_values , calc_ema(data, smooth), label=col_label, **plot_kws)
+            ema = emas[:, i]
+            if ( collection ):
+                line = CollectionLine( segments, plot_kws.get("color", default_colors[i % len(default_colors)]),
+                                       col_label )
+                line.set_data( *plot_decimate.decimate(x_values, ema, decimate, num_points) )
+            else:
+                line, = ax.plot( *plot_decimate.decimate(x_values, ema, decimate, num_points),
+                                 label=col_label, **plot_kws )
+            lines.append( (col_name, line, smooth, ema) )
 
         i+=1
 
-def plot_net(ax, cnl_file, args, layout):
+    ## one artist for all lines
+    if ( collection and lines ):
+        line_collection = matplotlib.collections.LineCollection( segments,
+                                colors=[ line.legend_handle.get_color() for col_name, line, ema_alpha, y_values in lines ],
+                                alpha=None if ema_only else alpha )
+        ax.add_collection(line_collection)
+        ax.autoscale_view()
+
+        for col_name, line, ema_alpha, y_values in lines:
+            line.collection = line_collection
+
+    return lines
+
+
+def get_legend_handles(lines):
+    """
+    Legend entries for [lines] as returned by |plot|.
+    """
+    return [ getattr(line, "legend_handle", line) for col_name, line, ema_alpha, y_values in lines ]
+
+def plot_net(ax, cnl_data, args, layout):
     # parameters
     legend_outside = True
     alpha = args.opacity if args.transparent_net else 1.0
@@ -149,48 +396,228 @@ def plot_net(ax, cnl_file, args, layout):
     ax.set_ylim(top=args.net_scale)
     ax.set_ylabel('Throughput (Bit/s)', fontsize=layout.fontsize.axis_labels)
 
-    plot(ax, cnl_file.x_values, cnl_file.cols, cnl_file.net_col_names, cnl_file.net_col_labels, alpha,
-         ema_only=True if smooth else False, smooth=smooth)
+    lines = plot(ax, cnl_data.x_values, cnl_data.cols, cnl_data.net_col_names, cnl_data.net_col_labels, alpha,
+                 ema_only=True if smooth else False, smooth=smooth, decimate=args.decimate,
+                 time_aware=args.time_aware_smoothing, durations=cnl_data.cols["duration"],
+                 collection=args.line_collection)
 
     # Legend
     if ( legend_outside ):
         offset = matplotlib.transforms.ScaledTranslation(0, -20, matplotlib.transforms.IdentityTransform())
         trans = ax.transAxes + offset
 
-        l = ax.legend( loc='upper left', bbox_to_anchor=(0, 0), ncol=int(len(cnl_file.net_col_names)/2),
+        l = ax.legend( handles=get_legend_handles(lines),
+                      loc='upper left', bbox_to_anchor=(0, 0), ncol=int(len(cnl_data.net_col_names)/2),
                       bbox_transform = trans,
                       fancybox=False, shadow=False, fontsize=layout.fontsize.legend)
     else:
-        l = ax.legend(loc=0)
+        l = ax.legend(handles=get_legend_handles(lines), loc=0)
+
+    return lines
 
 
-def plot_cpu(ax, cnl_file, args, layout):
+def plot_cpu(ax, cnl_data, args, layout):
     # parameters
     legend_outside = True
     alpha = args.opacity if args.transparent_cpu else 1.0
     smooth = args.smooth_cpu
 
+    if ( args.cpu_heatmap ):
+        plot_cpu_heatmap(ax, cnl_data, args, layout, args.cpu_heatmap)
+        return list()
+
     # axes
     ax.set_ylim(0,100)
     ax.set_ylabel('CPU util (%)', fontsize=layout.fontsize.axis_labels)
 
     # * plot *
-    plot(ax, cnl_file.x_values, cnl_file.cols, cnl_file.cpu_col_names, cnl_file.cpu_col_labels, alpha,
-         ema_only=True if smooth else False, smooth=smooth)
+    lines = plot(ax, cnl_data.x_values, cnl_data.cols, cnl_data.cpu_col_names, cnl_data.cpu_col_labels, alpha,
+                 ema_only=True if smooth else False, smooth=smooth, decimate=args.decimate,
+                 time_aware=args.time_aware_smoothing, durations=cnl_data.cols["duration"],
+                 collection=args.line_collection)
 
     # Legend
     if ( legend_outside ):
         offset = matplotlib.transforms.ScaledTranslation(0, -20, matplotlib.transforms.IdentityTransform())
         trans = ax.transAxes + offset
 
-        l = ax.legend( loc='upper left', bbox_to_anchor=(0, 0), ncol=int(len(cnl_file.cpu_col_names)/2),
+        l = ax.legend( handles=get_legend_handles(lines),
+                      loc='upper left', bbox_to_anchor=(0, 0), ncol=int(len(cnl_data.cpu_col_names)/2),
                       bbox_transform = trans,
                       fancybox=False, shadow=False, fontsize=layout.fontsize.legend)
     else:
-        l = ax.legend(loc=0)
+        l = ax.legend(handles=get_legend_handles(lines), loc=0)
 
     # l.draggable(True)
 
+    return lines
+
+
+
+class CollectionLine:
+    """
+    A single line of a LineCollection (see |plot|), with the |set_data| of a Line2D,
+    so that it can be updated like any other line (e.g. by |FollowUpdater| or |plot_decimate.ZoomUpdater|).
+    """
+
+    def __init__(self, segments, color, label, alpha=None, steps=False):
+        self.segments = segments
+        self.index = len(segments)
+        self.steps = steps
+        self.collection = None
+
+        # (not part of the axes; just for the legend)
+        self.legend_handle = matplotlib.lines.Line2D( [], [], color=color, label=label, alpha=alpha )
+
+        segments.append(None)
+
+    def set_data(self, x, y):
+        # (a LineCollection can't draw steps by itself)
+        if ( self.steps ):
+            x, y = steps_to_plateaus(x, y)
+
+        self.segments[self.index] = numpy.column_stack( (x, y) )
+
+        if ( self.collection ):
+            self.collection.set_segments(self.segments)
+
+
+
+class ArrayBuffer:
+    """
+    Growable 1-D numpy array (appending is amortized O(1)).
+    """
+
+    def __init__(self, values):
+        self.size = 0
+        self.data = numpy.empty( max(len(values), 1024) )
+        self.extend(values)
+
+    def extend(self, values):
+        new_size = self.size + len(values)
+
+        if ( new_size > len(self.data) ):
+            new_data = numpy.empty( max(new_size, 2 * len(self.data)) )
+            new_data[:self.size] = self.data[:self.size]
+            self.data = new_data
+
+        self.data[self.size:new_size] = values
+        self.size = new_size
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class FollowUpdater:
+    """
+    --follow: Periodically reads the samples that have been appended to the plotted files in the meantime
+    and appends them to the already existing lines (the files are not read again from the beginning).
+
+    Redraws at most |fps| times per second, and only if there are new samples.
+    """
+
+    def __init__(self, fig, ax, fps, margin=10, follow_x=True, decimate=None, time_aware=None):
+        self.fig = fig
+        self.ax = ax
+        self.margin = margin
+        self.follow_x = follow_x
+        self.decimate = decimate
+        self.time_aware = time_aware
+        self.max_x = None
+        self.files = list()
+
+        self.timer = fig.canvas.new_timer( interval=int(1000 / fps) )
+        self.timer.add_callback(self.update)
+
+    def add(self, cnl_data, lines, base_time):
+        """
+        [lines] as returned by |plot|
+        """
+        x_values = ArrayBuffer(cnl_data.x_values)
+        buffers = [ (col_name, line, ema_alpha, ArrayBuffer(y_values))
+                    for col_name, line, ema_alpha, y_values in lines ]
+
+        ## (same reference duration as |plot|)
+        ref_duration = None
+        if ( self.time_aware is not None ):
+            ref_duration = self.time_aware
+            if ( not ref_duration and len(cnl_data.cols["duration"]) > 0 ):
+                ref_duration = numpy.median(cnl_data.cols["duration"])
+
+        # steps or duplicated points? (see |plateau_x_values|; new samples are assumed to be contiguous)
+        num_samples = len(cnl_data.cols["begin"])
+        steps = is_steps(cnl_data.x_values, num_samples)
+
+        self.files.append( [cnl_data, base_time, x_values, buffers, ref_duration, steps] )
+
+    def start(self):
+        self.timer.start()
+
+    def update(self):
+        changed = False
+
+        for entry in self.files:
+            cnl_data, base_time, x_values, buffers, ref_duration, steps = entry
+            cols = cnl_data.follower.read_new_columns()
+            if ( len(cols["begin"]) == 0 ):
+                continue
+
+            changed = True
+            if ( steps ):
+                # (the end of the last sample is the begin of the next one)
+                if ( x_values.size == 0 ):
+                    x_values.extend( cols["begin"][:1] - base_time )
+                x_values.extend( cols["end"] - base_time )
+            else:
+                x_values.extend( numpy.column_stack( (cols["begin"], cols["end"]) ).ravel() - base_time )
+
+            ## (the first duration belongs to the last plotted value and isn't used)
+            ema_durations = None
+            ema_ref_duration = None
+            if ( self.time_aware is not None ):
+                if ( not ref_duration ):
+                    ref_duration = entry[4] = numpy.median(cols["duration"])
+
+                if ( steps ):
+                    ema_durations = numpy.concatenate( ([0.0], cols["duration"]) )
+                    ema_ref_duration = ref_duration
+                else:
+                    ema_durations = numpy.concatenate( ([0.0], numpy.repeat(cols["duration"] / 2, 2)) )
+                    ema_ref_duration = ref_duration / 2
+
+            for col_name, line, ema_alpha, y_values in buffers:
+                data = cols[col_name] if steps else numpy.repeat(cols[col_name], 2)
+
+                ## continue the ema from the last plotted value (or start with the first new one)
+                if ( ema_alpha ):
+                    first = y_values.view()[-1:] if y_values.size > 0 else data[:1]
+                    new_data = calc_ema_batch( numpy.concatenate( (first, data) )[:, None],
+                                               step_ema_alpha(ema_alpha) if steps else ema_alpha,
+                                               ema_durations, ema_ref_duration )[1:, 0]
+
+                    if ( steps and y_values.size == 0 ):
+                        new_data = numpy.concatenate( (data[:1], new_data) )
+
+                    data = new_data
+
+                ## steps: the last value is repeated, but now there are new ones
+                elif ( steps ):
+                    if ( y_values.size > 0 ):
+                        y_values.size -= 1
+                    data = step_y_values(data)
+
+                y_values.extend(data)
+                line.set_data( *plot_decimate.decimate(x_values.view(), y_values.view(), self.decimate,
+                                                       2 * plot_decimate.get_pixel_width(self.ax)) )
+
+            if ( not self.max_x or self.max_x < cols["end"][-1] - base_time ):
+                self.max_x = cols["end"][-1] - base_time
+
+        if ( changed ):
+            if ( self.follow_x ):
+                self.ax.set_xlim( right=self.max_x + self.margin )
+            self.fig.canvas.draw_idle()
+
 
 
 
@@ -217,6 +644,7 @@ if __name__ == "__main__":
     DEFAULT_OPACITY = 0.7
     DEFAULT_ALPHA = 0.1             # alpha for ema, the smaller the smoother
     DEFAULT_Y_RANGE = 1  # Gbit/s
+    DEFAULT_FPS = 2
 
     parser = argparse.ArgumentParser()
 
@@ -239,9 +667,39 @@ if __name__ == "__main__":
                         metavar="ALPHA",
                         help = "Smooth transmission rates with exponential moving average. (Disabled by default. When specified without parameter: ALPHA=0.1)" )
 
+    parser.add_argument("-ts", "--time-aware-smoothing", nargs='?', const=0.0, type=float,
+                        metavar="SECONDS",
+                        help = "Weight each sample by its duration when smoothing: ALPHA is the weight of a sample of SECONDS. (When specified without parameter: the median sample duration.)" )
+
     parser.add_argument("-nsc", "--net-scale", type=float, default=DEFAULT_Y_RANGE,
                         help="[Gbit/s]; Default: 1")
 
+    parser.add_argument("--x-min", type=float,
+                        help="[s] (relative to the earliest file). Samples before that are not even read.")
+    parser.add_argument("--x-max", type=float,
+                        help="[s] (relative to the earliest file). Samples after that are not even read.")
+
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="Keep the plot open and append new samples while the files are still being written (uncompressed files only; the area charts are not updated).")
+    parser.add_argument("--fps", type=float, default=DEFAULT_FPS,
+                        help="Maximum redraws per second with --follow. Default: 2")
+
+    parser.add_argument("--decimate", choices=plot_decimate.METHODS,
+                        help="Reduce every line to about the pixel width of the plot: min/max per bucket (peak-preserving) or LTTB. (Disabled by default.)")
+    parser.add_argument("--top-cpus", type=int, metavar="K",
+                        help="Only load and plot the K busiest CPUs (highest mean utilization).")
+    parser.add_argument("--top-nics", type=int, metavar="K",
+                        help="Only load and plot the K busiest NICs (highest mean throughput).")
+    parser.add_argument("-hm", "--cpu-heatmap", nargs='?', const="util",
+                        metavar="FIELD",
+                        help="Show the CPUs as heatmap (time x CPU) instead of lines. FIELD: any CPU field of the log, e.g. usr, system (Default: util)")
+    parser.add_argument("-lc", "--line-collection", action="store_true",
+                        help="Draw all lines of a plot as one LineCollection (faster drawing and PDF output with many CPUs/NICs).")
+    parser.add_argument("-f32", "--float32", action="store_true",
+                        help="Keep the loaded samples as float32 instead of float64 (half the memory; the timestamps stay float64).")
+    parser.add_argument("-zp", "--zoom-pyramid", action="store_true",
+                        help="Precompute min/max decimations at multiple resolutions and show the one that fits the visible range (full resolution when zoomed in). (Not together with --follow.)")
+
     parser.add_argument("-10g", "--is_10g", action="store_true",
                         help="Optimize plot-settings for 10G experiments.")
 
@@ -315,6 +773,32 @@ if __name__ == "__main__":
     min_x = None
     max_x = None
 
+    # --follow (only makes sense for the live view)
+    follow = args.follow and not args.output
+    followed_files = list()
+
+    if ( follow ):
+        for filename in args.files:
+            if ( not CNLFollower.can_follow(filename) ):
+                parser.error( "--follow only works with uncompressed CNL files: {}".format(filename) )
+
+    # -ts SECONDS (0: the median sample duration, see |calc_ema_batch|)
+    if ( args.time_aware_smoothing is not None and not args.time_aware_smoothing >= 0 ):
+        parser.error( "argument -ts/--time-aware-smoothing: must not be negative: {}".format(args.time_aware_smoothing) )
+
+    # -hm FIELD (the CPU fields are defined in the header of each file)
+    if ( args.cpu_heatmap ):
+        for filename in args.files:
+            cpu_fields = parsed_files.get_parser(filename).get_json_header()["ClassDefinitions"]["CPU"]["Fields"]
+            if ( args.cpu_heatmap not in cpu_fields ):
+                parser.error( "argument -hm/--cpu-heatmap: unknown CPU field '{}' in {} (choose from {})".format(
+                                args.cpu_heatmap, filename, ", ".join(cpu_fields) ) )
+
+    # --zoom-pyramid
+    zoom_updater = None
+    if ( args.zoom_pyramid and not follow ):
+        zoom_updater = plot_decimate.ZoomUpdater()
+
     old_ax_net = None
     old_ax_cpu = None
     for i in range(0, num_files):
@@ -331,17 +815,30 @@ if __name__ == "__main__":
 
         ## Read file
         filename = args.files[i]
-        cnl_file = parse_cnl_file(filename, nic_fields)
+        t_start, t_end = get_time_window(args.x_min, args.x_max, common_base_time)
+        cnl_file = parsed_files.get_parser(filename)
+
+        # Only the CPU fields that are plotted. (The top CPUs are ranked among all CPUs, also with --top-cpus.)
+        cpu_fields = ["util"]
+        all_cpu_fields = get_top_cpus_fields(cnl_file) if num_files == 1 else None
+        if ( args.cpu_heatmap ):
+            cpu_fields.append(args.cpu_heatmap)
+
+        cnl_data = parse_cnl_file(cnl_file, nic_fields, t_start=t_start, t_end=t_end, follow=follow,
+                                  top_cpus=args.top_cpus, top_nics=args.top_nics, cpu_fields=cpu_fields,
+                                  all_cpu_fields=all_cpu_fields,
+                                  dtype=numpy.float32 if args.float32 else numpy.float64)
         name_suggestor.add(cnl_file)
 
         ## update min_x / max_x
-        min_max = get_min_max_x(cnl_file)
+        if ( len(cnl_data.cols["begin"]) > 0 ):
+            min_max = get_min_max_x(cnl_data)
 
-        if ( not min_x or min_x > min_max[0] ):
-            min_x = min_max[0]
+            if ( not min_x or min_x > min_max[0] ):
+                min_x = min_max[0]
 
-        if ( not max_x or max_x < min_max[1] ):
-            max_x = min_max[1]
+            if ( not max_x or max_x < min_max[1] ):
+                max_x = min_max[1]
 
 
         ## show some output
@@ -373,18 +870,26 @@ if __name__ == "__main__":
         ## Prepare x_values
         plateau = True      ## XXX
         if ( plateau ):
-            cnl_file.x_values = merge_lists( cnl_file.cols["begin"], cnl_file.cols["end"] )
+            cnl_data.x_values = plateau_x_values( cnl_data.cols["begin"], cnl_data.cols["end"] )
         else:
-            cnl_file.x_values = cnl_file.cols["end"]
+            cnl_data.x_values = cnl_data.cols["end"]
 
         # shift x-values
         #base_time = cnl_file.get_machine_readable_date()
         base_time = common_base_time
-        cnl_file.x_values = [ x - base_time for x in cnl_file.x_values ]
+        cnl_data.x_values = cnl_data.x_values - base_time
 
         ## Plot
-        plot_net(ax_net, cnl_file, args, layout)
-        plot_cpu(ax_cpu, cnl_file, args, layout)
+        net_lines = plot_net(ax_net, cnl_data, args, layout)
+        cpu_lines = plot_cpu(ax_cpu, cnl_data, args, layout)
+
+        if ( follow ):
+            followed_files.append( (cnl_data, net_lines + cpu_lines, base_time) )
+
+        if ( zoom_updater ):
+            for ax, lines in ( (ax_net, net_lines), (ax_cpu, cpu_lines) ):
+                for col_name, line, ema_alpha, y_values in lines:
+                    zoom_updater.add(ax, line, cnl_data.x_values, y_values)
 
         old_ax_net = ax_net
         old_ax_cpu = ax_cpu
@@ -392,11 +897,18 @@ if __name__ == "__main__":
 
     ## If we have only one input file, plot CPU area charts.
     if ( num_files == 1 ):
-        ax1 = fig.add_subplot(2, num_cols, 2, sharex=old_ax_net, sharey=old_ax_cpu)
-        ax2 = fig.add_subplot(2, num_cols, 4, sharex=ax_net, sharey=old_ax_cpu)
+        # (the heatmap has CPUs on the y-axis, not percent)
+        area_sharey = None if args.cpu_heatmap else old_ax_cpu
+
+        ax1 = fig.add_subplot(2, num_cols, 2, sharex=old_ax_net, sharey=area_sharey)
+        ax2 = fig.add_subplot(2, num_cols, 4, sharex=ax_net, sharey=area_sharey or ax1)
         layout.set_tick_fontsize(plt, ax1, ax2)
 
-        plot_top_cpus( cnl_file, args, layout, (ax1, ax2), [0] )
+        plot_top_cpus( cnl_data, args, layout, (ax1, ax2), [0] )
+
+    # (zooming any axes re-decimates the lines on all axes that share its x-axis)
+    if ( zoom_updater ):
+        zoom_updater.connect_shared(fig)
 
 
     ## Set window margins
@@ -406,8 +918,20 @@ if __name__ == "__main__":
 
     ## TODO, maybe the TimeLocator can do this better? (see TimeLocator.view_limits)
     ## set min/max (remember: The x-axis is shared.)
-    in_plot_margin = max( (max_x - min_x) * 0.03, 10 )
-    ax_net.set_xlim(min_x - in_plot_margin - base_time, max_x + in_plot_margin - base_time)  ## XXX Like that, the base-time from the latest file is used...
+    if ( min_x is None ):   # (no samples, yet)
+        min_x = max_x = base_time
+
+    if ( args.x_min is not None and args.x_max is not None ):
+        ax_net.set_xlim(args.x_min, args.x_max)
+    else:
+        in_plot_margin = max( (max_x - min_x) * 0.03, 10 )
+        ax_net.set_xlim(min_x - in_plot_margin - base_time, max_x + in_plot_margin - base_time)  ## XXX Like that, the base-time from the latest file is used...
+
+        # explicit limit (either --x-min or --x-max)
+        if ( args.x_min is not None ):
+            ax_net.set_xlim( left=args.x_min )
+        if ( args.x_max is not None ):
+            ax_net.set_xlim( right=args.x_max )
 
 
     ## Format tick labels
@@ -451,6 +975,15 @@ if __name__ == "__main__":
 #    handler = EventHandler()
 
 
+    ## --follow: append new samples periodically
+    if ( follow ):
+        follow_updater = FollowUpdater(fig, ax_net, args.fps, follow_x=(args.x_max is None), decimate=args.decimate,
+                                       time_aware=args.time_aware_smoothing)
+        for cnl_data, lines, base_time in followed_files:
+            follow_updater.add(cnl_data, lines, base_time)
+        follow_updater.start()
+
+
     # Show / hardcopy plot
     if ( args.output ):
         plt.savefig(args.output, format="pdf")
@@ -0,0 +1,310 @@
+# -*- coding:utf-8 -*-
+
+# Copyright (c) 2014,
+# Karlsruhe Institute of Technology, Institute of Telematics
+#
+# This code is provided under the BSD 2-Clause License.
+# Please refer to the LICENSE.txt file for further information.
+#
+# Author: Mario Hock
+
+
+"""
+Reads bzip2 files with multiple streams (e.g. written by pbzip2) with several threads.
+
+Each stream starts byte-aligned with a header ("BZh" + level + block magic), so the compressed file
+can be cut there and the pieces can be decompressed independently. (The bz2 module releases the GIL
+while decompressing, so threads are enough.) The results are put together in file order;
+the output is exactly the same as with |bz2.open|.
+
+Until a second stream header is found, the file is decompressed sequentially in small pieces, like |bz2.open| does;
+thus plain single-stream files (e.g. written by the bzip2 tool) cost the same as with |bz2.open|, and reading just
+the header stays cheap. Pieces that can't be decompressed on their own later on (a stream without another header
+for more than |MAX_SEGMENT_SIZE| bytes, or something that just looks like a header inside a stream) are
+decompressed sequentially as well.
+
+The number of threads is the number of usable CPUs, unless set by the environment variable CNL_BZ2_THREADS.
+With one thread, this is just |bz2.open|.
+"""
+
+
+import os
+import io
+import re
+import bz2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+THREADS_ENV_VAR = "CNL_BZ2_THREADS"
+
+STREAM_HEADER = re.compile( rb"BZh[1-9]1AY&SY" )
+HEADER_SIZE = 10
+
+READ_SIZE = 4 * 2**20
+STREAM_READ_SIZE = 2**16     # (before a second stream header is found)
+MAX_SEGMENT_SIZE = 16 * 2**20
+
+
+def get_num_threads():
+    if ( os.environ.get(THREADS_ENV_VAR) ):
+        return max( int(os.environ[THREADS_ENV_VAR]), 1 )
+
+    try:
+        return len( os.sched_getaffinity(0) )
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def open(filename, mode="rb", threads=None):
+    """
+    Like |bz2.open| (reading, binary only).
+    """
+    if ( mode not in ("r", "rb") ):
+        raise ValueError( "Invalid mode: {}".format(mode) )
+
+    if ( threads is None ):
+        threads = get_num_threads()
+
+    if ( threads <= 1 ):
+        return bz2.open(filename, mode)
+
+    return io.BufferedReader( ParallelReader(filename, threads), buffer_size=io.DEFAULT_BUFFER_SIZE * 16 )
+
+
+def iter_segments(f):
+    """
+    Cuts the compressed data of |f| in front of every stream header.
+
+    Yields ( data, complete ): |complete| is False if the segment is not a whole stream that starts at a header
+    and ends at a header (or at the end of the file), i.e. it has to be decompressed sequentially.
+
+    As long as no second header has been found, the data is yielded in pieces of |STREAM_READ_SIZE| bytes
+    (not complete), so that a single-stream file is never held in memory as a whole.
+    """
+    data = b""
+    search_from = 1     # (don't cut in front of the header of the current segment)
+    multi_stream = False
+
+    while True:
+        chunk = f.read( READ_SIZE if multi_stream else STREAM_READ_SIZE )
+        data += chunk
+
+        ## Cut at all headers found so far.
+        #    (The piece in front of the second header still belongs to the sequentially decompressed stream.)
+        start = 0
+        for match in STREAM_HEADER.finditer(data, search_from):
+            if ( match.start() > start ):
+                yield data[start:match.start()], multi_stream
+            start = match.start()
+            multi_stream = True
+
+        data = data[start:]
+
+        if ( not chunk ):
+            if ( data ):
+                yield data, multi_stream
+            return
+
+        ## Still a single stream: pass it on piece by piece (but keep what could be the beginning of a header).
+        if ( not multi_stream ):
+            if ( len(data) >= HEADER_SIZE ):
+                yield data[ : len(data) - HEADER_SIZE + 1 ], False
+                data = data[ len(data) - HEADER_SIZE + 1 : ]
+            search_from = 0
+            continue
+
+        search_from = max( len(data) - HEADER_SIZE + 1, 1 )
+
+        ## No header for too long.
+        if ( len(data) > MAX_SEGMENT_SIZE ):
+            yield data, False
+            data = b""
+            search_from = 0
+
+
+def decompress_stream(data):
+    """
+    Returns ( decompressed data, decompressor ). (See |ParallelReader._next_data|.)
+    """
+    decompressor = bz2.BZ2Decompressor()
+
+    return decompressor.decompress(data), decompressor
+
+
+
+class ParallelReader(io.RawIOBase):
+    """
+    Raw, decompressed stream of the bzip2 file |filename| (see module description).
+
+    Seeking is only supported by reading (backwards: from the beginning), like with |bz2.BZ2File|.
+    """
+
+    def __init__(self, filename, threads):
+        self.filename = filename
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(threads)
+        self._rewind()
+
+    def _rewind(self):
+        if ( getattr(self, "file", None) ):
+            self._cancel()
+            self.file.close()
+
+        self.file = io.open(self.filename, "rb")
+        self.segments = iter_segments(self.file)
+        self.queue = deque()        # ( data, complete, future or None ), in file order
+        self.decompressor = None    # stream that is decompressed sequentially right now
+        self.buffer = b""
+        self.buffer_pos = 0
+        self.pos = 0
+        self.num_segments = 0
+        self.finished = False
+
+    def _cancel(self):
+        for data, complete, future in self.queue:
+            if ( future ):
+                future.cancel()
+        self.queue.clear()
+
+
+    def _fill_queue(self):
+        # (just one segment ahead for the first one, so that reading only the header stays cheap)
+        lookahead = 1 if self.num_segments == 0 else 2 * self.threads
+
+        while ( len(self.queue) < lookahead ):
+            try:
+                data, complete = next(self.segments)
+            except StopIteration:
+                return
+
+            future = self.pool.submit(decompress_stream, data) if complete else None
+            self.queue.append( (data, complete, future) )
+
+
+    def _next_data(self):
+        """
+        Returns the decompressed data of the next segment (b"" if there's none; None at the end).
+        """
+        self._fill_queue()
+        if ( not self.queue ):
+            return None
+
+        data, complete, future = self.queue.popleft()
+        self.num_segments += 1
+
+        ## The current stream is not finished yet: this segment continues it.
+        #    (Then, the parallel result is useless; the header was not a real one.)
+        if ( self.decompressor ):
+            if ( future ):
+                future.cancel()
+            return self._decompress_sequentially(data)
+
+        ## Decompressed in parallel.
+        if ( future ):
+            out, decompressor = future.result()
+
+        ## Too long to wait for: The beginning of a long stream ...
+        elif ( self.num_segments == 1 or STREAM_HEADER.match(data) ):
+            out, decompressor = decompress_stream(data)
+
+        ## ... or data behind the end of a stream.
+        else:
+            return self._decompress_trailing(data)
+
+        if ( not decompressor.eof ):
+            self.decompressor = decompressor
+        elif ( decompressor.unused_data ):
+            out += self._decompress_trailing(decompressor.unused_data)
+
+        return out
+
+    def _decompress_sequentially(self, data):
+        out = self.decompressor.decompress(data)
+
+        if ( self.decompressor.eof ):
+            unused = self.decompressor.unused_data
+            self.decompressor = None
+
+            if ( unused ):
+                out += self._decompress_trailing(unused)
+
+        return out
+
+    def _decompress_trailing(self, data):
+        """
+        Data behind the end of a stream, that doesn't start with a header (as found by |iter_segments|):
+        Like |bz2.BZ2File|, try it as another stream, and ignore it if it isn't one.
+        """
+        try:
+            out, decompressor = decompress_stream(data)
+        except OSError:
+            self._finish()
+            return b""
+
+        if ( not decompressor.eof ):
+            self.decompressor = decompressor
+        elif ( decompressor.unused_data ):
+            out += self._decompress_trailing(decompressor.unused_data)
+
+        return out
+
+    def _finish(self):
+        self._cancel()
+        self.finished = True
+
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        while ( self.buffer_pos >= len(self.buffer) ):
+            if ( self.finished ):
+                return 0
+
+            data = self._next_data()
+            if ( data is None ):
+                if ( self.decompressor ):
+                    raise EOFError( "Compressed file ended before the end-of-stream marker was reached" )
+                return 0
+
+            self.buffer = data
+            self.buffer_pos = 0
+
+        n = min( len(b), len(self.buffer) - self.buffer_pos )
+        b[:n] = self.buffer[self.buffer_pos : self.buffer_pos + n]
+        self.buffer_pos += n
+        self.pos += n
+
+        return n
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if ( whence == io.SEEK_CUR ):
+            offset += self.pos
+        elif ( whence == io.SEEK_END ):
+            raise io.UnsupportedOperation( "Can't seek relative to the end of a compressed file" )
+
+        if ( offset < self.pos ):
+            self._rewind()
+
+        ## Skip forward.
+        skip = bytearray( min( offset - self.pos, READ_SIZE ) )
+        while ( self.pos < offset ):
+            if ( self.readinto( memoryview(skip)[: offset - self.pos] ) == 0 ):
+                break
+
+        return self.pos
+
+    def close(self):
+        if ( not self.closed ):
+            self._cancel()
+            self.pool.shutdown(wait=False)
+            self.file.close()
+
+        super().close()
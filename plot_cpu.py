@@ -10,13 +10,14 @@
 
 
 from collections import defaultdict
-from operator import itemgetter
 from matplotlib import transforms
+import matplotlib.ticker
 import numpy
 import copy
 import math
 
-from cnl_library import merge_lists
+from cnl_library import step_y_values
+import plot_decimate
 
 
 CPU_COLORS = defaultdict(lambda : "grey")
@@ -28,7 +29,26 @@ CPU_COLORS["util"] = "red"      ## XXX
 CPU_COLORS["idle"] = "blue"     ## XXX
 
 
-def _create_cpu_cols_by_util(cnl_file):
+def get_area_chart_fields(cnl_file):
+    """
+    The CPU fields that are stacked in the area charts (usr, system, ...; all but "idle" and "util").
+    """
+    cpu_fields = copy.copy( cnl_file.get_json_header()["ClassDefinitions"]["CPU"]["Fields"] )
+    cpu_fields.remove("idle")
+    cpu_fields.remove("util")
+
+    return cpu_fields
+
+
+def get_top_cpus_fields(cnl_file):
+    """
+    The CPU fields (of each CPU) that |plot_top_cpus| needs.
+    """
+    return ["util"] + get_area_chart_fields(cnl_file)
+
+
+
+def _create_cpu_cols_by_util(cnl_data):
     """
     The actual creation of the "virtual top-cpus" is outsourced to this function:
 
@@ -37,49 +57,55 @@ def _create_cpu_cols_by_util(cnl_file):
     first sort the CPUs by CPU utilization;
 
     then, for the top-n CPU (n from 1 to num_cpus),
-    append the values of the cpu-utilization fields (usr, system, ...).
+    take the values of the cpu-utilization fields (usr, system, ...).
 
     Also, stores which CPU was the top-n CPU in the respective sample.
+
+    All samples are sorted at once: The fields of all CPUs are arranged in a (samples x cpus x fields) array,
+    which is reordered along the CPU axis by a single argsort of the utilization.
+    The returned columns (one dict per rank) are views into that array.
+
+    All CPUs are ranked, not only the plotted ones (see |all_cpu_fields| in |cnl_plot.parse_cnl_file|).
     """
-    cpus = cnl_file.get_cpus()
-    cpu_fields = cnl_file.get_json_header()["ClassDefinitions"]["CPU"]["Fields"]
-    num_samples = len(cnl_file.cols["begin"])
+    cpus = cnl_data.parser.get_cpus()
+    cpu_fields = get_top_cpus_fields(cnl_data.parser)
+    num_samples = len(cnl_data.cols["begin"])
 
-    # init return list (of dicts of lists)
-    top_cpus = list()
-    for cpu in cpus:
-        elem = dict()
-        elem["name"] = list()
-        for field in cpu_fields:
-            elem[field] = list()
+    # (samples x cpus) utilization
+    utils = numpy.column_stack( [ cnl_data.cols[cpu + ".util"] for cpu in cpus ] )
 
-        top_cpus.append(elem)
+    # Sort the CPUs of each sample by utilization, descending.
+    #   (stable, i.e. on equal utilization the original CPU order is kept)
+    order = numpy.argsort( -utils, axis=1, kind="stable" )
 
+    # (samples x cpus x fields), already sorted along the CPU axis
+    sorted_values = numpy.empty( (num_samples, len(cpus), len(cpu_fields)), dtype=utils.dtype )
+    for f, field in enumerate(cpu_fields):
+        values = numpy.column_stack( [ cnl_data.cols[cpu + "." + field] for cpu in cpus ] )
+        sorted_values[:, :, f] = numpy.take_along_axis( values, order, axis=1 )
 
-    # Fill return list.
-    for i in range(num_samples):
-        cpu_utils = [ (cpu, cnl_file.cols[cpu + ".util"][i]) for cpu in cpus ]
-        cpus_sorted_by_util = sorted( cpu_utils, key=itemgetter(1), reverse=True)
+    names = numpy.array(cpus)[order]
 
-        for top_cpu, cur_cpu in zip(top_cpus, cpus_sorted_by_util):
-            cpu_name = cur_cpu[0]
+    # return list (of dicts of arrays)
+    top_cpus = list()
+    for rank in range( len(cpus) ):
+        elem = dict()
+        elem["name"] = names[:, rank]
+        for f, field in enumerate(cpu_fields):
+            elem[field] = sorted_values[:, rank, f]
 
-            top_cpu["name"].append(cpu_name)
-            for field in cpu_fields:
-                top_cpu[field].append( cnl_file.cols[cpu_name + "." + field][i] )
+        top_cpus.append(elem)
 
     return top_cpus
 
 
 
-def plot_area_chart(ax, cnl_file, args, layout, cols, legend_outside, legend_title):
+def plot_area_chart(ax, cnl_data, args, layout, cols, legend_outside, legend_title):
     """
     Plots an area chart of the CPU utilization (usr, sys, ...).
     """
 
-    cpu_fields = copy.copy( cnl_file.get_json_header()["ClassDefinitions"]["CPU"]["Fields"] )
-    cpu_fields.remove("idle")
-    cpu_fields.remove("util")
+    cpu_fields = get_area_chart_fields(cnl_data.parser)
 
     # Axes
     ax.set_ylim(0,100)
@@ -87,24 +113,25 @@ def plot_area_chart(ax, cnl_file, args, layout, cols, legend_outside, legend_tit
     ax.set_ylabel('CPU util (%)', fontsize=layout.fontsize.axis_labels)
 
     # Plot
-    y_offsets = numpy.array([0.0] * len(cnl_file.cols["begin"]))
+    y_offsets = numpy.array([0.0] * len(cnl_data.cols["begin"]))
+    steps = ( len(cnl_data.x_values) == len(y_offsets) + 1 )     # (see |plateau_x_values|)
     z = 0
     for field in cpu_fields:
         #values = cols[field]
         v = cols[field] + y_offsets
-        values = merge_lists( v, v )
+        values = step_y_values(v) if steps else numpy.repeat(v, 2)
 
         # as bar chart -- slooooow!!
-        #ax.bar(cnl_file.cols["begin"], values, cnl_file.cols["duration"], bottom=y_offsets,
+        #ax.bar(cnl_data.cols["begin"], values, cnl_data.cols["duration"], bottom=y_offsets,
                #color=CPU_COLORS[field], label=field)
 
         # draw with lines (okay, but not filled..)
-        #ax.plot(cnl_file.x_values, values,
+        #ax.plot(cnl_data.x_values, values,
                #color=CPU_COLORS[field], label=field, zorder=z)
 
 
         # fill (seems to be the best option)
-        ax.fill_between(cnl_file.x_values, values, 0,
+        ax.fill_between(cnl_data.x_values, values, 0, step="post" if steps else None,
                color=CPU_COLORS[field], label=field, zorder=z)
 
 
@@ -145,7 +172,47 @@ def plot_area_chart(ax, cnl_file, args, layout, cols, legend_outside, legend_tit
     # l.draggable(True)
 
 
-def plot_top_cpus(cnl_file, args, layout, axes, indices=[0]):
+def plot_cpu_heatmap(ax, cnl_data, args, layout, field="util"):
+    """
+    Plots |field| (see ClassDefinitions.CPU.Fields) of all CPUs as heatmap: time x CPU.
+
+    The time is binned to the pixel width of |ax| (averaged by the time each sample overlaps a bin),
+    so this stays readable and fast to draw with hundreds of CPUs and long logs.
+    """
+
+    cpus = cnl_data.cpu_col_labels
+    if ( field not in cnl_data.parser.get_json_header()["ClassDefinitions"]["CPU"]["Fields"] ):
+        raise ValueError( "Unknown CPU field: {}".format(field) )
+
+    values = numpy.column_stack( [ cnl_data.cols[cpu + "." + field] for cpu in cpus ] )
+    edges, bins = plot_decimate.time_weighted_bins( cnl_data.cols["begin"], cnl_data.cols["end"], values,
+                                                    plot_decimate.get_pixel_width(ax) )
+
+    # Axes
+    ax.set_ylabel('CPU', fontsize=layout.fontsize.axis_labels)
+    ax.yaxis.set_major_locator( matplotlib.ticker.MaxNLocator(integer=True) )
+    ax.yaxis.set_major_formatter( matplotlib.ticker.FuncFormatter(
+                                    lambda y, pos: cpus[int(y)] if 0 <= int(y) < len(cpus) else "" ) )
+
+    if ( len(edges) == 0 ):
+        return
+
+    # (x-values are shifted by the base time)
+    shift = cnl_data.x_values[0] - cnl_data.cols["begin"][0]
+
+    # Plot
+    image = ax.imshow( bins.T, aspect="auto", origin="lower", interpolation="nearest",
+                       extent=(edges[0] + shift, edges[-1] + shift, -0.5, len(cpus) - 0.5),
+                       vmin=0, vmax=100 )
+
+    # Color bar (where the legend would be)
+    cax = ax.inset_axes( [0, -0.25, 0.5, 0.05] )
+    colorbar = ax.figure.colorbar(image, cax=cax, orientation="horizontal")
+    colorbar.set_label( "CPU {} (%)".format(field), fontsize=layout.fontsize.legend )
+
+
+
+def plot_top_cpus(cnl_data, args, layout, axes, indices=[0]):
     """
     This function creates "virtual top-cpus" and plots the utilization fields (usr, system, ...)
 
@@ -162,10 +229,10 @@ def plot_top_cpus(cnl_file, args, layout, axes, indices=[0]):
 
     """
 
-    top_cpus = _create_cpu_cols_by_util(cnl_file)
+    top_cpus = _create_cpu_cols_by_util(cnl_data)
 
     for ax, i in zip(axes, indices):
         label = "Top #{} CPU".format(i+1)
         cols = top_cpus[i]
-        plot_area_chart(ax, cnl_file, args, layout, cols, True, label)
+        plot_area_chart(ax, cnl_data, args, layout, cols, True, label)
 
@@ -0,0 +1,276 @@
+# -*- coding:utf-8 -*-
+
+# Copyright (c) 2014,
+# Karlsruhe Institute of Technology, Institute of Telematics
+#
+# This code is provided under the BSD 2-Clause License.
+# Please refer to the LICENSE.txt file for further information.
+#
+# Author: Mario Hock
+
+
+"""
+Reduces the number of points of a series before it is handed to matplotlib,
+to roughly what can be displayed anyway (the pixel width of the axes).
+
+This is only meant for plotting; summaries etc. should always use the original data.
+"""
+
+
+import numpy
+from collections import defaultdict
+
+
+METHODS = ("minmax", "lttb")
+
+
+def get_pixel_width(ax):
+    return max( int(ax.get_window_extent().width), 1 )
+
+
+def minmax_decimate(x, y, num_buckets):
+    """
+    Peak-preserving decimation: Splits the series into (up to) |num_buckets| buckets of equal size
+    and only keeps the minimum and the maximum of each bucket (in their original order).
+
+    Returns (x, y) as numpy arrays.
+    """
+    x = numpy.asarray(x)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n = len(y)
+
+    if ( n <= 2 * num_buckets ):
+        return x, y
+
+    bucket_size = -(-n // num_buckets)     # (ceil)
+    num_buckets = -(-n // bucket_size)
+
+    ## One bucket per row (the last one is padded with the last value).
+    buckets = numpy.empty( num_buckets * bucket_size )
+    buckets[:n] = y
+    buckets[n:] = y[-1]
+    buckets = buckets.reshape(num_buckets, bucket_size)
+
+    offsets = numpy.arange(num_buckets) * bucket_size
+    min_pos = offsets + numpy.argmin(buckets, axis=1)
+    max_pos = offsets + numpy.argmax(buckets, axis=1)
+
+    ## Keep both (in original order), and always the first and the last point.
+    indices = numpy.unique( numpy.concatenate( (min_pos, max_pos, [0, n-1]) ) )
+    indices = indices[indices < n]
+
+    return x[indices], y[indices]
+
+
+def lttb(x, y, num_points):
+    """
+    Largest-Triangle-Three-Buckets: Selects |num_points| points that preserve the visual shape of the series.
+    (First and last point are always kept; from each bucket in between, the point that spans the largest triangle
+    with the previously selected point and the average of the next bucket.)
+
+    Returns (x, y) as numpy arrays.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n = len(y)
+
+    if ( num_points >= n or num_points < 3 ):
+        return x, y
+
+    bounds = numpy.linspace(1, n-1, num_points - 1).astype(numpy.int64)
+
+    ## Average of each bucket (the last "bucket" is the last point).
+    sums_x = numpy.add.reduceat(x[:n-1], bounds[:-1])
+    sums_y = numpy.add.reduceat(y[:n-1], bounds[:-1])
+    counts = numpy.diff(bounds)
+    avg_x = numpy.append( sums_x / counts, x[-1] )
+    avg_y = numpy.append( sums_y / counts, y[-1] )
+
+    indices = numpy.empty(num_points, dtype=numpy.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range( num_points - 2 ):
+        start = bounds[i]
+        end = bounds[i+1]
+
+        # (double) area of the triangles between the point a, the candidates and the average of the next bucket
+        areas = numpy.abs( (x[a] - avg_x[i+1]) * (y[start:end] - y[a]) -
+                           (x[a] - x[start:end]) * (avg_y[i+1] - y[a]) )
+
+        a = start + numpy.argmax(areas)
+        indices[i+1] = a
+
+    return x[indices], y[indices]
+
+
+def decimate(x, y, method, num_points):
+    """
+    Reduces the series (x, y) to about |num_points| points (method: see |METHODS|, None: no reduction).
+    """
+    if ( not method ):
+        return x, y
+
+    if ( method == "minmax" ):
+        return minmax_decimate(x, y, max(num_points // 2, 1))
+    elif ( method == "lttb" ):
+        return lttb(x, y, num_points)
+
+    raise ValueError( "Unknown decimation method: {}".format(method) )
+
+
+def time_weighted_bins(begin, end, columns, num_bins):
+    """
+    Averages |columns| (2-D array, one row per sample from |begin| to |end|) over |num_bins| equally long
+    time bins from the first begin to the last end. Each sample is weighted by the time it overlaps a bin.
+
+    Returns ( bin edges, 2-D array with one row per bin ); NaN for bins without any sample.
+
+    ***
+
+    The integral of each column over time is piecewise linear (the values are constant within a sample),
+    so it can be interpolated exactly at the bin edges; the averages are the differences divided by the
+    covered time (which is interpolated the same way, thus gaps between samples don't count).
+    """
+    begin = numpy.asarray(begin, dtype=numpy.float64)
+    end = numpy.asarray(end, dtype=numpy.float64)
+    columns = numpy.asarray(columns, dtype=numpy.float64)
+
+    if ( len(begin) == 0 ):
+        return numpy.empty(0), numpy.empty( (0, columns.shape[1]) )
+
+    edges = numpy.linspace(begin[0], end[-1], num_bins + 1)
+
+    ## Integrals at the sample borders: [begin_0, end_0, begin_1, end_1, ...]
+    t = numpy.column_stack( (begin, end) ).ravel()
+
+    durations = end - begin
+    covered = numpy.concatenate( ([0.0], numpy.cumsum(durations)) )
+    integrals = numpy.concatenate( (numpy.zeros( (1, columns.shape[1]) ),
+                                    numpy.cumsum(columns * durations[:, None], axis=0)) )
+
+    covered = numpy.repeat(covered, 2)[1:-1]
+    integrals = numpy.repeat(integrals, 2, axis=0)[1:-1]
+
+    ## Interpolate at the bin edges
+    right = numpy.clip( numpy.searchsorted(t, edges, side="right"), 1, len(t) - 1 )
+    left = right - 1
+    width = t[right] - t[left]
+    fraction = numpy.clip( numpy.divide(edges - t[left], width, out=numpy.zeros_like(edges), where=width > 0), 0, 1 )
+
+    covered = covered[left] + fraction * (covered[right] - covered[left])
+    integrals = integrals[left] + fraction[:, None] * (integrals[right] - integrals[left])
+
+    ## Averages
+    time = numpy.diff(covered)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        averages = numpy.diff(integrals, axis=0) / time[:, None]
+    averages[time <= 0] = numpy.nan
+
+    return edges, averages
+
+
+
+class MinMaxPyramid:
+    """
+    Precomputed min/max decimations of a series at multiple resolutions.
+
+    Level 0 is the original series, on level k each bucket of 2^k original points is represented
+    by its minimum and its maximum. Thus, any x-range can be shown with a bounded number of points,
+    but still in full resolution when zoomed in far enough.
+
+    (Each level is stored as sorted indices into the original series, plus the corresponding x-values.)
+    """
+
+    def __init__(self, x, y, min_points=1024):
+        self.x = numpy.asarray(x)
+        self.y = numpy.asarray(y, dtype=numpy.float64)
+
+        n = len(self.y)
+        self.levels = [ (numpy.arange(n), self.x) ]    # (indices, x-values)
+
+        ## Merge pairs of buckets from level to level.
+        min_idx = numpy.arange(n)
+        max_idx = min_idx
+        while ( 2 * len(min_idx) > min_points ):
+            # (odd number of buckets: the last one is merged with itself)
+            if ( len(min_idx) % 2 == 1 ):
+                min_idx = numpy.append(min_idx, min_idx[-1])
+                max_idx = numpy.append(max_idx, max_idx[-1])
+
+            a = min_idx[0::2]
+            b = min_idx[1::2]
+            min_idx = numpy.where( self.y[a] <= self.y[b], a, b )
+
+            a = max_idx[0::2]
+            b = max_idx[1::2]
+            max_idx = numpy.where( self.y[a] >= self.y[b], a, b )
+
+            # min and max of each bucket, in their original order
+            #   (the buckets are in order, so are the resulting indices)
+            indices = numpy.column_stack( (numpy.minimum(min_idx, max_idx), numpy.maximum(min_idx, max_idx)) ).ravel()
+
+            # (level 1 doesn't save anything)
+            if ( len(indices) < len(self.levels[-1][0]) ):
+                self.levels.append( (indices, self.x[indices]) )
+
+
+    def get_view(self, x_min, x_max, max_points):
+        """
+        Returns (x, y) of the finest level that shows [x_min, x_max] with at most |max_points| points
+        (plus one point on each side, so that the lines reach the borders).
+        """
+        for indices, x in self.levels:
+            first = max( numpy.searchsorted(x, x_min, side="left") - 1, 0 )
+            last = numpy.searchsorted(x, x_max, side="right") + 1
+
+            if ( last - first <= max_points ):
+                break
+
+        indices = indices[first:last]
+
+        return self.x[indices], self.y[indices]
+
+
+
+class ZoomUpdater:
+    """
+    Swaps in the right |MinMaxPyramid| level for the visible x-range of the lines,
+    whenever the x-limits of their axes change (zoom, pan, ...).
+
+    Thus, redrawing costs depend on the screen width, not on the length of the series.
+    """
+
+    def __init__(self, points_per_pixel=2):
+        self.points_per_pixel = points_per_pixel
+        self.lines = defaultdict(list)
+        self.connected = set()
+
+    def add(self, ax, line, x, y):
+        self.lines[ax].append( (line, MinMaxPyramid(x, y)) )
+        self._connect(ax)
+
+    def connect_shared(self, fig):
+        """
+        Also listens to all other axes of |fig| that share the x-axis with decimated lines
+        (e.g. a heatmap or area chart, that can be zoomed as well). Call this once all axes are created.
+        """
+        for ax in fig.get_axes():
+            if ( any( sibling in self.lines for sibling in ax.get_shared_x_axes().get_siblings(ax) ) ):
+                self._connect(ax)
+
+    def _connect(self, ax):
+        if ( ax not in self.connected ):
+            ax.callbacks.connect("xlim_changed", self.on_xlim_changed)
+            self.connected.add(ax)
+
+    def on_xlim_changed(self, ax):
+        x_min, x_max = ax.get_xlim()
+
+        # NOTE: matplotlib only notifies the axes whose limits were set, not the ones sharing its x-axis.
+        for sibling in ax.get_shared_x_axes().get_siblings(ax):
+            max_points = self.points_per_pixel * get_pixel_width(sibling)
+
+            for line, pyramid in self.lines.get(sibling, ()):
+                line.set_data( *pyramid.get_view(x_min, x_max, max_points) )
@@ -12,9 +12,11 @@
 
 import time
 import os
+import numpy
 from itertools import zip_longest
 
-from cnl_library import CNLParser, pretty_json, human_readable_from_seconds
+from cnl_library import CNLParser, ZoneMap, create_csv_index, pretty_json, human_readable_from_seconds
+from cnl_library import WEIGHTED_SUM, FIRST_ACTIVE, LAST_ACTIVE
 from split_text import split_proprtionally
 
 ## some "constants"/preferences
@@ -24,6 +26,9 @@ unit = "MBits"
 
 
 def format_timestamp(t):
+    if ( t is None ):
+        return "-"
+
     return time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime(t))
 
 def sprint_bold(text):
@@ -43,6 +48,47 @@ def print_in_two_columns(format_str, left_col, right_col):
 
 
 
+def sequential_sum(values, start=0.0):
+    """
+    Sums up |values| strictly from left to right (like a Python loop would),
+    other than numpy.sum which uses pairwise summation (and thus rounds slightly differently).
+
+    |start| is the sum so far, e.g. of the previous chunk. (Thus, summing chunk by chunk gives the same result.)
+    """
+    if ( len(values) == 0 ):
+        return start
+
+    return numpy.add.accumulate( numpy.concatenate( ([start], values) ) )[-1]
+
+
+def sequential_run_sums(values, starts, lengths, max_steps=64):
+    """
+    Returns the |sequential_sum| of each run values[starts[i] : starts[i]+lengths[i]].
+
+    Short runs are summed up in parallel (element by element); the few long runs one after the other.
+    """
+    sums = numpy.zeros( len(starts) )
+
+    ## Short runs: add the j-th element of all runs that are long enough, at once.
+    short = lengths <= max_steps
+    short_starts = starts[short]
+    short_lengths = lengths[short]
+    short_sums = numpy.zeros( len(short_starts) )
+
+    for j in range( short_lengths.max() if len(short_lengths) > 0 else 0 ):
+        sel = short_lengths > j
+        short_sums[sel] += values[ short_starts[sel] + j ]
+
+    sums[short] = short_sums
+
+    ## Long runs (there can't be many of them).
+    for i in numpy.flatnonzero(~short):
+        sums[i] = sequential_sum( values[ starts[i] : starts[i]+lengths[i] ] )
+
+    return sums
+
+
+
 def show_match(left_file, right_file, env=None):
     """
     Displays a brief summary of two CNL-file next to each other.
@@ -68,16 +114,24 @@ def show_match(left_file, right_file, env=None):
 
 class LogAnalyzer:
 
-    def __init__(self, cnl_file):
+    def __init__(self, cnl_file, summary=None, t_start=None, t_end=None, build_zone_map=False):
+        """
+        @param summary [dict] Results of an earlier analysis of the same file (see |get_summary|),
+                              e.g. stored in |cnl_catalog|. In this case, the file isn't read at all.
+
+        @param t_start, t_end  Only analyze the lines that overlap with this time window
+                               (absolute timestamps, see |CNLParser.get_csv_iterator|).
+
+        @param build_zone_map  Time windows are summarized from the zone map (see |_summarize_blocks|), if the file
+                               has one. If True, a missing zone map is built (and stored as sidecar) first.
+        """
         self.cnl_file = cnl_file
+        self.t_start = t_start
+        self.t_end = t_end
 
         ## Get all fields to watch for activity (NIC, send and receive)
         self.nics = cnl_file.get_nics()
-        self.watch_fields = list()
-        nic_fields = [".send", ".receive"]
-        for nic_name in self.nics:
-            for nic_field in nic_fields:
-                self.watch_fields.append( nic_name + nic_field )
+        self.watch_fields = cnl_file.get_activity_fields()
 
         # important csv indices
         self.watch_indices = cnl_file.get_csv_indices_of(self.watch_fields)
@@ -96,58 +150,181 @@ class LogAnalyzer:
         self.pause_time = 0
 
         ## Trigger "summarize"
-        self._summarize()
+        if ( summary ):
+            self._restore(summary)
+            return
 
+        ## (The whole file is always summarized exactly.)
+        zone_map = None
+        if ( t_start is not None or t_end is not None ):
+            zone_map = cnl_file.get_zone_map(build_zone_map)
 
-    def _is_activity(self, line):
-        for field_name in self.watch_indices:
-            if ( float( line[field_name] ) > 0 ):
-                return True
+        if ( zone_map ):
+            self._summarize_blocks(zone_map)
+        else:
+            self._summarize()
 
-        return False
 
-    def _sum_line(self, line):
-        # Summarize the values of all watched fields (data send/received).
-        for i in range( len(self.sums) ):
-            self.sums[i] += line[ self.watch_indices[i] ] * line[self.duration_index]
+    def _summarize_blocks(self, zone_map):
+        """
+        Computes the summary from the statistics of the blocks of |zone_map| (see |CNLParser.get_zone_map|);
+        only the blocks at the edges of the time window are read.
 
+        NOTE: The sums are added up block by block, so they may differ from |_summarize| in the last digits.
+        """
+        fields = ["begin", "end", "duration"] + self.watch_fields
+        edge_index = create_csv_index(fields)
 
-    def _get_begin(self, line):
-        return line[self.begin_index]
+        ## Idle time since the last activity (only counted, if there's activity afterwards).
+        open_idle = 0.0
 
-    def _get_end(self, line):
-        return line[self.end_index]
+        for block, complete in zone_map.select(self.t_start, self.t_end):
+            if ( complete ):
+                stats = zone_map.stats[block]
+                idle = zone_map.idle[block]
+                trailing_idle = zone_map.trailing_idle[block]
+                cols = self.watch_indices
 
+            ## Edge of the time window: Only some of the lines count.
+            else:
+                array = self.cnl_file.read_zone_block(zone_map, block, fields, self.t_start, self.t_end)
+                rows, stats, idle, trailing_idle = ZoneMap.block_stats(array, edge_index, self.watch_fields)
+                cols = list( range(3, len(fields)) )
 
-    def _summarize(self):
-        probably_pause_time = 0
+            ## Sum watched columns (data send/received).
+            for i, col in enumerate(cols):
+                self.sums[i] = float( self.sums[i] + stats[WEIGHTED_SUM, col] )
 
-        for line in self.cnl_file.get_csv_iterator():
-            ## Sum watched columns.
-            self._sum_line(line)
+            ## No activity in this block: The idle time since the last activity just gets longer.
+            first_active = stats[FIRST_ACTIVE, cols]
+            if ( numpy.all( numpy.isnan(first_active) ) ):
+                open_idle += idle
+                continue
 
-            ## Find experiment start and end time.
-            if ( self._is_activity(line) ):
+            ## Experiment start and end time.
+            if ( self.experiment_start_time is None ):
+                self.experiment_start_time = float( numpy.nanmin(first_active) )
+            self.experiment_end_time = float( numpy.nanmax(stats[LAST_ACTIVE, cols]) )
+
+            ## Idle time up to the last activity of this block.
+            self.pause_time = float( self.pause_time + open_idle + (idle - trailing_idle) )
+            open_idle = trailing_idle
 
-                # Find begin of the experiment.
-                if ( not self.experiment_start_time ):
-                    self.experiment_start_time = self._get_begin(line)
 
-                # Find end of the experiment.
-                self.experiment_end_time = self._get_end(line)
+        self._set_experiment_duration()
 
-                # Since the experiment apparently has started and not finished yet,
-                #   the last observed idle time was actually during the experiment.
-                #   --> So, track it.
-                self.pause_time += probably_pause_time
-                probably_pause_time = 0
 
-            ## Keep track of idle states during the experiment.
+    def _summarize(self, rows=65536):
+        """
+        Reads the file chunk by chunk (see |CNLParser.iter_chunks|), so that memory usage doesn't depend on its size.
+
+        NOTE: All sums are computed strictly sequentially (carried over from chunk to chunk),
+              so that the results are exactly the same as adding up line by line.
+
+        NOTE: For text files, the time is spent almost entirely on parsing the body; an existing
+              column cache (see |CNLParser.get_column_cache|) is read instead, which is much faster.
+        """
+        fields = ["begin", "end", "duration"] + self.watch_fields
+
+        ## Sum of the idle run that is still open at the end of the previous chunk (None: no open run).
+        open_idle_sum = None
+
+        for chunk in self.cnl_file.iter_chunks(fields, rows, self.t_start, self.t_end):
+            cols = { name: chunk[:, i] for i, name in enumerate(fields) }
+            duration = cols["duration"]
+
+            ## Sum watched columns (data send/received).
+            for i, field in enumerate(self.watch_fields):
+                self.sums[i] = float( sequential_sum( cols[field] * duration, self.sums[i] ) )
+
+            ## Activity: Any of the watched fields is > 0.
+            active = numpy.zeros( len(duration), dtype=bool )
+            for field in self.watch_fields:
+                active |= ( cols[field] > 0 )
+
+            active_lines = numpy.flatnonzero(active)
+
+            ## No activity in this chunk: The open idle run just gets longer.
+            if ( len(active_lines) == 0 ):
+                open_idle_sum = sequential_sum( duration, 0.0 if open_idle_sum is None else open_idle_sum )
+                continue
+
+            first = active_lines[0]
+            last = active_lines[-1]
+
+            ## Find experiment start and end time.
+            if ( self.experiment_start_time is None ):
+                self.experiment_start_time = float( cols["begin"][first] )
+            self.experiment_end_time = float( cols["end"][last] )
+
+            ## Idle states during the experiment: Each run of idle lines that is followed by an active line.
+            #    (Idle lines after the last activity are not counted.)
+            idle = numpy.concatenate( ([0], ~active[:last] * 1, [0]) )
+            edges = numpy.diff(idle)
+            starts = numpy.flatnonzero(edges == 1)
+            lengths = numpy.flatnonzero(edges == -1) - starts
+
+            run_sums = sequential_run_sums(duration, starts, lengths)
+
+            ## The run that was open at the end of the previous chunk ends here.
+            if ( open_idle_sum is not None ):
+                if ( len(starts) > 0 and starts[0] == 0 ):
+                    run_sums[0] = sequential_sum( duration[:lengths[0]], open_idle_sum )
+                else:
+                    run_sums = numpy.concatenate( ([open_idle_sum], run_sums) )
+
+            if ( len(run_sums) > 0 ):
+                self.pause_time = float( sequential_sum(run_sums, self.pause_time) )
+
+            ## Idle lines behind the last activity (might be followed by activity in the next chunk).
+            if ( last + 1 < len(duration) ):
+                open_idle_sum = sequential_sum( duration[last+1:] )
             else:
-                probably_pause_time += line[self.duration_index]
+                open_idle_sum = None
+
+
+        self._set_experiment_duration()
+
+
+
+    def _set_experiment_duration(self):
+        ## (No activity at all, e.g. in the time window: nothing to average over.)
+        if ( self.experiment_start_time is None ):
+            self.experiment_duration = 0.0
+        else:
+            self.experiment_duration = self.experiment_end_time - self.experiment_start_time
+
+
+    def get_rate(self, i, time):
+        """
+        Average rate of the watched field |i| over |time| seconds (0 if there's no such time).
+        """
+        if ( time <= 0 ):
+            return 0.0
+
+        return self.sums[i] / time
+
+
+    def get_summary(self):
+        """
+        Returns the results of the analysis as (JSON-serializable) dict.
+        """
+        summary = dict()
+        summary["experiment_start_time"] = self.experiment_start_time
+        summary["experiment_end_time"] = self.experiment_end_time
+        summary["sums"] = self.sums
+        summary["pause_time"] = self.pause_time
+
+        return summary
+
 
+    def _restore(self, summary):
+        self.experiment_start_time = summary["experiment_start_time"]
+        self.experiment_end_time = summary["experiment_end_time"]
+        self.sums = summary["sums"]
+        self.pause_time = summary["pause_time"]
 
-        self.experiment_duration = self.experiment_end_time - self.experiment_start_time
+        self._set_experiment_duration()
 
 
 
@@ -173,14 +350,14 @@ class LogAnalyzer:
         # Show average transmission rates.
         print("== Average transmission rates ==")
         for i in range( len(self.sums) ):
-            speed = round(self.sums[i] / divisor / self.experiment_duration, rounding_digits)
+            speed = round(self.get_rate(i, self.experiment_duration) / divisor, rounding_digits)
             print( "{:<13} {:>10} {}/s".format(self.watch_fields[i]+":", speed, unit) )
 
 
     def show_brief(self):
         speeds = list()
         for i in range( len(self.sums) ):
-            speed = "{:.2f}".format( round(self.sums[i] / divisor / self.experiment_duration, rounding_digits) )
+            speed = "{:.2f}".format( round(self.get_rate(i, self.experiment_duration) / divisor, rounding_digits) )
             speeds.append( "{:>8} {}/s".format(speed, unit) )
 
         speeds_str = " ".join(speeds)
@@ -238,7 +415,7 @@ class LogAnalyzer:
 
         rates = list()
         for i in range( len(self.sums) ):
-            speed = self.sums[i] / (self.experiment_duration-self.pause_time)
+            speed = self.get_rate(i, self.experiment_duration-self.pause_time)
 
             number_str = "{:.2f}".format( round(speed / divisor, rounding_digits) )
             bar_str = "{:<20}".format(number_str + " " + unit + "/s")